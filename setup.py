@@ -19,11 +19,13 @@ setup(
     py_modules=[
         "PiicoDev_Unified",
         "PiicoDev_MPU6050",
+        "PiicoDev_AHRS",
         "PiicoDev_TMP117",
         "PiicoDev_VEML6030",
         "PiicoDev_VL53L1X",
         "PiicoDev_BME280",
         "PiicoDev_MS5637",
+        "PiicoDev_Altitude",
         "PiicoDev_VEML6040",
         "PiicoDev_CAP1203",
         "PiicoDev_SSD1306",
@@ -32,6 +34,8 @@ setup(
         "PiicoDev_QMC6310",
         "PiicoDev_RFID",
         "PiicoDev_RFID_Expansion",
+        "PiicoDev_RFID_Provision",
+        "PiicoDev_NDEF",
         "PiicoDev_RV3028",
         "PiicoDev_LIS3DH",
         "PiicoDev_Potentiometer",
@@ -39,6 +43,8 @@ setup(
         "PiicoDev_Switch",
         "PiicoDev_Servo",
         "PiicoDev_Transceiver",
+        "PiicoDev_Transceiver_Mesh",
+        "PiicoDev_Transceiver_Sim",
         "PiicoDev_Ultrasonic",
         "PiicoDev_MMC5603",
     ],
@@ -0,0 +1,256 @@
+# Attitude and heading reference for the PiicoDev motion and magnetometer sensors
+# Fuses gyro (PiicoDev_MPU6050), accelerometer (PiicoDev_MPU6050, PiicoDev_LIS3DH) and magnetometer
+# (PiicoDev_MMC5603, PiicoDev_QMC6310) samples with a Madgwick or Mahony filter into an orientation
+# quaternion, Euler angles and a tilt compensated heading, while estimating the gyro bias.
+#
+# Example:
+#   motion = PiicoDev_MPU6050()
+#   compass = PiicoDev_MMC5603()
+#   ahrs = PiicoDev_AHRS()
+#   while True:
+#       ahrs.update(motion.read_gyro_data(), motion.read_accel_data(), compass.read())
+#       print(ahrs.heading())
+#
+# All vectors must be in the same right handed sensor frame, so remap axes if the boards are mounted differently.
+# Gyro samples are in deg/s; accelerometer and magnetometer samples may be in any unit. Euler angles are roll
+# about x, pitch about y and yaw about z (z up), and the heading is clockwise from magnetic north to the x axis.
+
+from PiicoDev_Unified import *
+from array import array
+from math import sqrt, atan2, asin, sin, cos, pi
+
+_DEG2RAD = pi / 180
+_RAD2DEG = 180 / pi
+
+MADGWICK = 'madgwick'
+MAHONY = 'mahony'
+
+# x, y and z of a dict (eg. PiicoDev_MPU6050.read_gyro_data(), PiicoDev_MMC5603.read()) or a sequence (eg. PiicoDev_LIS3DH.acceleration)
+def _xyz(v):
+    if isinstance(v, dict):
+        return v['x'], v['y'], v['z']
+    return v[0], v[1], v[2]
+
+class PiicoDev_AHRS(object):
+    # algorithm: MADGWICK or MAHONY
+    # beta: Madgwick gain, how strongly accel and mag correct the gyro [rad/s]
+    # zeta: Madgwick gyro bias gain, 0 disables bias estimation [rad/s]
+    # kp, ki: Mahony proportional gain and integral (gyro bias) gain, ki=0 disables bias estimation
+    # declination: added to heading() [deg]
+    def __init__(self, algorithm=MADGWICK, beta=0.1, zeta=0.015, kp=1.0, ki=0.05, declination=0.0, clock=ticks_ms):
+        if algorithm not in (MADGWICK, MAHONY):
+            raise ValueError("algorithm must be 'madgwick' or 'mahony'")
+        self.algorithm = algorithm
+        self.beta = beta
+        self.zeta = zeta
+        self.kp = kp
+        self.ki = ki
+        self.declination = declination
+        self._clock = clock
+        self._step = self._madgwick if algorithm == MADGWICK else self._mahony
+        self.reset()
+
+    # Forget the orientation and gyro bias. The next sample with an accelerometer reading starts again
+    def reset(self):
+        self.q = (1.0, 0.0, 0.0, 0.0)
+        self._bias = [0.0, 0.0, 0.0] # [rad/s]
+        self._time = None
+        self._initialised = False
+
+    # Feed one sample taken at timestamp_ms (ticks_ms(), now if None). gyro may be None for an accelerometer and
+    # magnetometer only setup (eg. PiicoDev_LIS3DH), mag may be None to track attitude without heading. Returns the quaternion
+    def update(self, gyro, accel, mag=None, timestamp_ms=None):
+        if timestamp_ms is None:
+            timestamp_ms = self._clock()
+        dt = ticks_diff(timestamp_ms, self._time) / 1000 if self._time is not None else 0.0
+        self._time = timestamp_ms
+        return self._update(gyro, accel, mag, dt)
+
+    # Feed a block read with PiicoDev_MPU6050.read_fifo() (scaled). mag is applied to every sample in the block.
+    # Only the first sample is timed with ticks; the rest are block.period_ms apart
+    def update_fifo(self, block, mag=None):
+        if block.count == 0:
+            return self.q
+        samples = block.samples
+        self.update((samples[4], samples[5], samples[6]), (samples[0], samples[1], samples[2]), mag, block.timestamp_ms)
+        dt = block.period_ms / 1000
+        for j in range(7, 7 * block.count, 7):
+            self._update((samples[j + 4], samples[j + 5], samples[j + 6]), (samples[j], samples[j + 1], samples[j + 2]), mag, dt)
+        self._time = ticks_add(block.timestamp_ms, int(round((block.count - 1) * block.period_ms)))
+        return self.q
+
+    def _update(self, gyro, accel, mag, dt):
+        ax, ay, az = _xyz(accel)
+        if mag is None:
+            mx = my = mz = 0.0
+        else:
+            mx, my, mz = _xyz(mag)
+        if not self._initialised:
+            self._initialise(ax, ay, az, mx, my, mz)
+            return self.q
+        if gyro is None:
+            gx = gy = gz = 0.0
+        else:
+            gx, gy, gz = _xyz(gyro)
+        self._step(gx * _DEG2RAD, gy * _DEG2RAD, gz * _DEG2RAD, ax, ay, az, mx, my, mz, dt)
+        return self.q
+
+    # Reprocess recorded samples. gyro, accel and mag are sequences of samples in the units update() takes, or flat
+    # sequences of x, y, z values; mag may be None. Samples are sample_period_ms apart unless timestamps_ms is given.
+    # Returns an array('f') with the quaternion (w, x, y, z) after each sample, or roll, pitch and yaw [deg] when euler=True
+    def process(self, gyro, accel, mag=None, sample_period_ms=None, timestamps_ms=None, euler=False):
+        gyro, accel = self._flatten(gyro), self._flatten(accel)
+        mag = self._flatten(mag) if mag is not None else None
+        count = len(accel) // 3
+        if timestamps_ms is None and sample_period_ms is None:
+            raise ValueError('sample_period_ms or timestamps_ms is needed')
+        width = 3 if euler else 4
+        out = array('f', bytes(4 * width * count))
+        step = self._step
+        for i in range(count):
+            j = 3 * i
+            ax, ay, az = accel[j], accel[j + 1], accel[j + 2]
+            if mag is None:
+                mx = my = mz = 0.0
+            else:
+                mx, my, mz = mag[j], mag[j + 1], mag[j + 2]
+            if timestamps_ms is not None:
+                dt = (timestamps_ms[i] - timestamps_ms[i - 1]) / 1000 if i > 0 else 0.0
+            else:
+                dt = sample_period_ms / 1000
+            if not self._initialised:
+                self._initialise(ax, ay, az, mx, my, mz)
+            else:
+                step(gyro[j] * _DEG2RAD, gyro[j + 1] * _DEG2RAD, gyro[j + 2] * _DEG2RAD, ax, ay, az, mx, my, mz, dt)
+            out[width * i:width * (i + 1)] = array('f', self.euler() if euler else self.q)
+        return out
+
+    # Roll, pitch and yaw [deg]
+    def euler(self):
+        q0, q1, q2, q3 = self.q
+        roll = atan2(2 * (q0 * q1 + q2 * q3), 1 - 2 * (q1 * q1 + q2 * q2))
+        sinp = 2 * (q0 * q2 - q3 * q1)
+        pitch = asin(max(-1.0, min(1.0, sinp)))
+        yaw = atan2(2 * (q0 * q3 + q1 * q2), 1 - 2 * (q2 * q2 + q3 * q3))
+        return (roll * _RAD2DEG, pitch * _RAD2DEG, yaw * _RAD2DEG)
+
+    # Tilt compensated heading, 0 to 360 clockwise from north [deg]
+    def heading(self):
+        return (self.declination - self.euler()[2]) % 360
+
+    # Estimated gyro bias, already removed from the gyro samples [deg/s]
+    def gyro_bias(self):
+        return (self._bias[0] * _RAD2DEG, self._bias[1] * _RAD2DEG, self._bias[2] * _RAD2DEG)
+
+    def _flatten(self, samples):
+        if len(samples) and not isinstance(samples[0], (int, float)):
+            flat = []
+            for sample in samples:
+                flat.extend(_xyz(sample))
+            return flat
+        return samples
+
+    # Start from the attitude given by gravity and the heading given by the magnetometer
+    def _initialise(self, ax, ay, az, mx, my, mz):
+        if ax == 0 and ay == 0 and az == 0:
+            return
+        roll = atan2(ay, az)
+        pitch = atan2(-ax, sqrt(ay * ay + az * az))
+        yaw = 0.0
+        if mx != 0 or my != 0 or mz != 0:
+            sr, cr, sp, cp = sin(roll), cos(roll), sin(pitch), cos(pitch)
+            hx = mx * cp + my * sr * sp + mz * cr * sp
+            hy = my * cr - mz * sr
+            yaw = atan2(-hy, hx)
+        cr, sr = cos(roll / 2), sin(roll / 2)
+        cp, sp = cos(pitch / 2), sin(pitch / 2)
+        cy, sy = cos(yaw / 2), sin(yaw / 2)
+        self.q = (cr * cp * cy + sr * sp * sy, sr * cp * cy - cr * sp * sy, cr * sp * cy + sr * cp * sy, cr * cp * sy - sr * sp * cy)
+        self._initialised = True
+
+    # Integrate the gyro rate [rad/s] plus correction into the quaternion
+    def _integrate(self, gx, gy, gz, s0, s1, s2, s3, dt):
+        q0, q1, q2, q3 = self.q
+        q0, q1, q2, q3 = (q0 + (0.5 * (-q1 * gx - q2 * gy - q3 * gz) - s0) * dt,
+                          q1 + (0.5 * (q0 * gx + q2 * gz - q3 * gy) - s1) * dt,
+                          q2 + (0.5 * (q0 * gy - q1 * gz + q3 * gx) - s2) * dt,
+                          q3 + (0.5 * (q0 * gz + q1 * gy - q2 * gx) - s3) * dt)
+        norm = sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+        self.q = (q0 / norm, q1 / norm, q2 / norm, q3 / norm)
+
+    # Madgwick gradient descent step, with gyro bias drift compensation (zeta)
+    def _madgwick(self, gx, gy, gz, ax, ay, az, mx, my, mz, dt):
+        q0, q1, q2, q3 = self.q
+        s0 = s1 = s2 = s3 = 0.0
+        norm = sqrt(ax * ax + ay * ay + az * az)
+        if norm > 0:
+            ax, ay, az = ax / norm, ay / norm, az / norm
+            # Gravity: objective function f and its Jacobian J, gradient is J^T f
+            f0 = 2 * (q1 * q3 - q0 * q2) - ax
+            f1 = 2 * (q0 * q1 + q2 * q3) - ay
+            f2 = 1 - 2 * (q1 * q1 + q2 * q2) - az
+            s0 = -2 * q2 * f0 + 2 * q1 * f1
+            s1 = 2 * q3 * f0 + 2 * q0 * f1 - 4 * q1 * f2
+            s2 = -2 * q0 * f0 + 2 * q3 * f1 - 4 * q2 * f2
+            s3 = 2 * q1 * f0 + 2 * q2 * f1
+            norm = sqrt(mx * mx + my * my + mz * mz)
+            if norm > 0:
+                mx, my, mz = mx / norm, my / norm, mz / norm
+                # Earth frame field, with the horizontal part rotated onto north
+                hx = (1 - 2 * (q2 * q2 + q3 * q3)) * mx + 2 * (q1 * q2 - q0 * q3) * my + 2 * (q1 * q3 + q0 * q2) * mz
+                hy = 2 * (q1 * q2 + q0 * q3) * mx + (1 - 2 * (q1 * q1 + q3 * q3)) * my + 2 * (q2 * q3 - q0 * q1) * mz
+                bz = 2 * (q1 * q3 - q0 * q2) * mx + 2 * (q2 * q3 + q0 * q1) * my + (1 - 2 * (q1 * q1 + q2 * q2)) * mz
+                bx = sqrt(hx * hx + hy * hy)
+                f0 = bx * (1 - 2 * (q2 * q2 + q3 * q3)) + 2 * bz * (q1 * q3 - q0 * q2) - mx
+                f1 = 2 * bx * (q1 * q2 - q0 * q3) + 2 * bz * (q0 * q1 + q2 * q3) - my
+                f2 = 2 * bx * (q0 * q2 + q1 * q3) + bz * (1 - 2 * (q1 * q1 + q2 * q2)) - mz
+                s0 += -2 * bz * q2 * f0 + (-2 * bx * q3 + 2 * bz * q1) * f1 + 2 * bx * q2 * f2
+                s1 += 2 * bz * q3 * f0 + (2 * bx * q2 + 2 * bz * q0) * f1 + (2 * bx * q3 - 4 * bz * q1) * f2
+                s2 += (-4 * bx * q2 - 2 * bz * q0) * f0 + (2 * bx * q1 + 2 * bz * q3) * f1 + (2 * bx * q0 - 4 * bz * q2) * f2
+                s3 += (-4 * bx * q3 + 2 * bz * q1) * f0 + (-2 * bx * q0 + 2 * bz * q2) * f1 + 2 * bx * q1 * f2
+            norm = sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+            if norm > 0:
+                s0, s1, s2, s3 = s0 / norm, s1 / norm, s2 / norm, s3 / norm
+                if self.zeta:
+                    # Gyro error is the rotation the gradient asks for. Its integral is the bias
+                    bias = self._bias
+                    bias[0] += 2 * (q0 * s1 - q1 * s0 - q2 * s3 + q3 * s2) * self.zeta * dt
+                    bias[1] += 2 * (q0 * s2 + q1 * s3 - q2 * s0 - q3 * s1) * self.zeta * dt
+                    bias[2] += 2 * (q0 * s3 - q1 * s2 + q2 * s1 - q3 * s0) * self.zeta * dt
+        bias = self._bias
+        beta = self.beta
+        self._integrate(gx - bias[0], gy - bias[1], gz - bias[2], beta * s0, beta * s1, beta * s2, beta * s3, dt)
+
+    # Mahony complementary filter step. The integral term is the gyro bias estimate
+    def _mahony(self, gx, gy, gz, ax, ay, az, mx, my, mz, dt):
+        q0, q1, q2, q3 = self.q
+        ex = ey = ez = 0.0
+        norm = sqrt(ax * ax + ay * ay + az * az)
+        if norm > 0:
+            ax, ay, az = ax / norm, ay / norm, az / norm
+            # Error is the cross product of measured and estimated directions
+            vx = 2 * (q1 * q3 - q0 * q2)
+            vy = 2 * (q0 * q1 + q2 * q3)
+            vz = 1 - 2 * (q1 * q1 + q2 * q2)
+            ex, ey, ez = ay * vz - az * vy, az * vx - ax * vz, ax * vy - ay * vx
+            norm = sqrt(mx * mx + my * my + mz * mz)
+            if norm > 0:
+                mx, my, mz = mx / norm, my / norm, mz / norm
+                hx = (1 - 2 * (q2 * q2 + q3 * q3)) * mx + 2 * (q1 * q2 - q0 * q3) * my + 2 * (q1 * q3 + q0 * q2) * mz
+                hy = 2 * (q1 * q2 + q0 * q3) * mx + (1 - 2 * (q1 * q1 + q3 * q3)) * my + 2 * (q2 * q3 - q0 * q1) * mz
+                bz = 2 * (q1 * q3 - q0 * q2) * mx + 2 * (q2 * q3 + q0 * q1) * my + (1 - 2 * (q1 * q1 + q2 * q2)) * mz
+                bx = sqrt(hx * hx + hy * hy)
+                wx = bx * (1 - 2 * (q2 * q2 + q3 * q3)) + 2 * bz * (q1 * q3 - q0 * q2)
+                wy = 2 * bx * (q1 * q2 - q0 * q3) + 2 * bz * (q0 * q1 + q2 * q3)
+                wz = 2 * bx * (q0 * q2 + q1 * q3) + bz * (1 - 2 * (q1 * q1 + q2 * q2))
+                ex += my * wz - mz * wy
+                ey += mz * wx - mx * wz
+                ez += mx * wy - my * wx
+            if self.ki:
+                bias = self._bias
+                bias[0] -= self.ki * ex * dt
+                bias[1] -= self.ki * ey * dt
+                bias[2] -= self.ki * ez * dt
+        bias = self._bias
+        kp = self.kp
+        self._integrate(gx - bias[0] + kp * ex, gy - bias[1] + kp * ey, gz - bias[2] + kp * ez, 0.0, 0.0, 0.0, 0.0, dt)
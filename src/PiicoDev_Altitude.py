@@ -0,0 +1,136 @@
+# Barometric altitude and vertical speed for the PiicoDev pressure sensors (BME280, MS5637)
+# Pressure is converted to altitude with a precomputed lookup table instead of a power per sample,
+# and a Kalman filter estimates altitude and vertical speed from the noisy readings. Vertical
+# acceleration from an accelerometer (PiicoDev_LIS3DH, PiicoDev_MPU6050) can be fused in as well.
+#
+# Example:
+#   sensor = PiicoDev_MS5637()
+#   estimator = PiicoDev_Altitude()
+#   for temperature, pressure, timestamp in sensor.stream():
+#       altitude, vertical_speed = estimator.add_pressure(pressure, timestamp)
+
+from PiicoDev_Unified import *
+from array import array
+from math import sqrt
+
+_STANDARD_GRAVITY = 9.80665 # [m/s^2]
+
+# Lookup table of altitude over the ratio of pressure to sea level pressure
+_RATIO_MIN = 0.25 # about 10km
+_RATIO_MAX = 1.15
+_RATIO_STEP = 0.0025 # interpolation error is below 0.07m over the table
+
+# International barometric formula, as used by PiicoDev_BME280.altitude() and PiicoDev_MS5637.read_altitude()
+def _hypsometric(ratio):
+    return 44330*(1-ratio**(1/5.255))
+
+_TABLE = array('f', [_hypsometric(_RATIO_MIN + i*_RATIO_STEP) for i in range(int(round((_RATIO_MAX - _RATIO_MIN)/_RATIO_STEP)) + 1)])
+
+# Altitude [m] for a pressure and sea level pressure (both in hPa), interpolated from the lookup table
+def pressure_to_altitude(pressure, pressure_sea_level=1013.25):
+    position = (pressure/pressure_sea_level - _RATIO_MIN)/_RATIO_STEP
+    index = int(position)
+    if position < 0 or index >= len(_TABLE) - 1:
+        return _hypsometric(pressure/pressure_sea_level) # outside the table
+    fraction = position - index
+    return _TABLE[index] + (_TABLE[index + 1] - _TABLE[index])*fraction
+
+class PiicoDev_Altitude(object):
+    # altitude_noise: standard deviation of a single altitude reading from pressure [m]
+    # acceleration_noise: unmodelled vertical acceleration when no accelerometer is used [m/s^2]
+    # accelerometer_noise: error of the fused vertical acceleration [m/s^2]
+    # gravity_weight: low-pass weight used to track the direction of gravity in accelerometer samples
+    # accelerometer_timeout_ms: accelerometer samples older than this are no longer used for prediction
+    def __init__(self, pressure_sea_level=1013.25, altitude_noise=0.5, acceleration_noise=1.0, accelerometer_noise=0.3,
+                 gravity_weight=0.02, accelerometer_timeout_ms=500, clock=ticks_ms):
+        self.pressure_sea_level = pressure_sea_level
+        self.altitude_noise = altitude_noise
+        self.acceleration_noise = acceleration_noise
+        self.accelerometer_noise = accelerometer_noise
+        self.gravity_weight = gravity_weight
+        self.accelerometer_timeout_ms = accelerometer_timeout_ms
+        self._clock = clock
+        self.reset()
+
+    # Forget the estimate. The next pressure sample starts it again
+    def reset(self):
+        self.altitude = None
+        self.vertical_speed = 0.0
+        self.vertical_acceleration = 0.0
+        self._p = [[0.0, 0.0], [0.0, 0.0]] # covariance of (altitude, vertical speed)
+        self._time = None
+        self._gravity = None # low-passed accelerometer vector
+        self._accelerometer_time = None
+
+    # Feed a pressure sample [hPa] taken at timestamp_ms (ticks_ms(), now if None). Returns (altitude [m], vertical speed [m/s])
+    def add_pressure(self, pressure, timestamp_ms=None):
+        if timestamp_ms is None:
+            timestamp_ms = self._clock()
+        measured = pressure_to_altitude(pressure, self.pressure_sea_level)
+        if self.altitude is None:
+            self.altitude = measured
+            self.vertical_speed = 0.0
+            self._p = [[self.altitude_noise**2, 0.0], [0.0, 1.0]]
+            self._time = timestamp_ms
+            return (self.altitude, self.vertical_speed)
+        self._predict(timestamp_ms)
+        # Kalman update with the altitude measurement
+        p = self._p
+        s = p[0][0] + self.altitude_noise**2
+        k0 = p[0][0]/s
+        k1 = p[1][0]/s
+        residual = measured - self.altitude
+        self.altitude += k0*residual
+        self.vertical_speed += k1*residual
+        self._p = [[(1 - k0)*p[0][0], (1 - k0)*p[0][1]],
+                   [p[1][0] - k1*p[0][0], p[1][1] - k1*p[0][1]]]
+        return (self.altitude, self.vertical_speed)
+
+    # Feed an accelerometer sample [m/s^2] as (x, y, z), a dict with 'x', 'y' and 'z' (PiicoDev_MPU6050.read_accel_data())
+    # or PiicoDev_LIS3DH.acceleration. Any orientation works: vertical acceleration is the projection onto the direction
+    # of gravity, tracked by low-passing the samples. The estimate is moved forward to timestamp_ms
+    def add_acceleration(self, acceleration, timestamp_ms=None):
+        if timestamp_ms is None:
+            timestamp_ms = self._clock()
+        if isinstance(acceleration, dict):
+            x, y, z = acceleration['x'], acceleration['y'], acceleration['z']
+        else:
+            x, y, z = acceleration
+        g = self._gravity
+        if g is None:
+            g = [x, y, z]
+        else:
+            w = self.gravity_weight
+            g = [g[0] + w*(x - g[0]), g[1] + w*(y - g[1]), g[2] + w*(z - g[2])]
+        self._gravity = g
+        norm = sqrt(g[0]*g[0] + g[1]*g[1] + g[2]*g[2])
+        if norm == 0:
+            return
+        if self.altitude is not None:
+            self._predict(timestamp_ms)
+        self.vertical_acceleration = (x*g[0] + y*g[1] + z*g[2])/norm - _STANDARD_GRAVITY
+        self._accelerometer_time = timestamp_ms
+
+    def _fused(self, timestamp_ms):
+        return self._accelerometer_time is not None and ticks_diff(timestamp_ms, self._accelerometer_time) <= self.accelerometer_timeout_ms
+
+    # Move the estimate forward to timestamp_ms, driven by the latest vertical acceleration if an accelerometer is in use
+    def _predict(self, timestamp_ms):
+        dt = ticks_diff(timestamp_ms, self._time)/1000
+        if dt <= 0:
+            return
+        self._time = timestamp_ms
+        if self._fused(timestamp_ms):
+            a = self.vertical_acceleration
+            q = self.accelerometer_noise**2
+        else:
+            a = 0.0
+            q = self.acceleration_noise**2
+        self.altitude += self.vertical_speed*dt + 0.5*a*dt*dt
+        self.vertical_speed += a*dt
+        p = self._p
+        p00 = p[0][0] + dt*(p[1][0] + p[0][1]) + dt*dt*p[1][1] + q*dt**4/4
+        p01 = p[0][1] + dt*p[1][1] + q*dt**3/2
+        p10 = p[1][0] + dt*p[1][1] + q*dt**3/2
+        p11 = p[1][1] + q*dt*dt
+        self._p = [[p00, p01], [p10, p11]]
@@ -4,14 +4,29 @@
 # Original repo https://bit.ly/2yJwysL
 
 from PiicoDev_Unified import *
+import struct
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 compat_str = '\nUnified PiicoDev library out of date.  Get the latest module: https://piico.dev/unified \n'
 
+_REG_CALIB_00 = 0x88 # T1 to P9, then H1 at 0xA1
+_REG_CALIB_26 = 0xE1 # H2 to H6
+_REG_DATA     = 0xF7 # press_msb to hum_lsb
+_DATA_LENGTH  = 8
+
+_MODE_SLEEP  = 0
+_MODE_FORCED = 1
+_MODE_NORMAL = 3
+_T_SB_MS = (0.5, 62.5, 125, 250, 500, 1000, 10, 20) # normal mode standby time for each t_sb setting
+
 class PiicoDev_BME280:
 
     def __init__(self, bus=None, freq=None, sda=None, scl=None, t_mode=2, p_mode=5, h_mode=1, iir=1, address=0x77):
         try:
-            if compat_ind >= 1:
+            if compat_ind >= 2:
                 pass
             else:
                 print(compat_str)
@@ -24,32 +39,28 @@ class PiicoDev_BME280:
         self.iir = iir
         self.addr = address
 
+        self.mode = _MODE_FORCED
+        self.t_sb = 0
+
         self._t_fine = 0
+        self._buf = bytearray(_DATA_LENGTH)
+        self._conversion_started = None
+        self._normal_started = None
+        self._last_index = None
+        self._last = None # values() of the last read
+        self._read_ms = 0 # ticks_ms the last read was made at
+        self._read_age = 0 # age of the measurement at that read [ms]
         try:
-            self._T1 = self._read16(0x88)
+            calib = bytes(self.i2c.readfrom_mem(self.addr, _REG_CALIB_00, 26))
         except Exception as e:
             print(i2c_err_str.format(self.addr))
             raise e
-        self._T2 = self._short(self._read16(0x8A))
-        self._T3 = self._short(self._read16(0x8C))
-        self._P1 = self._read16(0x8E)
-        self._P2 = self._short(self._read16(0x90))
-        self._P3 = self._short(self._read16(0x92))
-        self._P4 = self._short(self._read16(0x94))
-        self._P5 = self._short(self._read16(0x96))
-        self._P6 = self._short(self._read16(0x98))
-        self._P7 = self._short(self._read16(0x9A))
-        self._P8 = self._short(self._read16(0x9C))
-        self._P9 = self._short(self._read16(0x9E))
-        self._H1 = self._read8(0xA1)
-        self._H2 = self._short(self._read16(0xE1))
-        self._H3 = self._read8(0xE3)
-        a = self._read8(0xE5)
-        self._H4 = (self._read8(0xE4)<<4)+(a%16)
-        self._H5 = (self._read8(0xE6)<<4)+(a>>4)
-        self._H6 = self._read8(0xE7)
-        if self._H6 > 127:
-            self._H6 -= 256
+        (self._T1, self._T2, self._T3, self._P1, self._P2, self._P3, self._P4, self._P5,
+         self._P6, self._P7, self._P8, self._P9, self._H1) = struct.unpack_from('<HhhHhhhhhhhhxB', calib)
+        calib = bytes(self.i2c.readfrom_mem(self.addr, _REG_CALIB_26, 7))
+        self._H2, self._H3, e4, e5, e6, self._H6 = struct.unpack_from('<hBBBBb', calib)
+        self._H4 = (e4<<4)+(e5%16)
+        self._H5 = (e6<<4)+(e5>>4)
         self._write8(0xF2, self.h_mode)
         sleep_ms(2)
         self._write8(0xF4, 0x24)
@@ -73,8 +84,10 @@ class PiicoDev_BME280:
         else:
             return dat
 
-    def read_raw_data(self):
-        self._write8(0xF4, (self.p_mode << 5 | self.t_mode << 2 | 1))
+    def _ctrl_meas(self, mode):
+        return self.p_mode << 5 | self.t_mode << 2 | mode
+
+    def _measurement_time_us(self):
         sleep_time = 1250
         if self.t_mode in [1, 2, 3, 4, 5]:
             sleep_time += 2300*(1<< self.t_mode)
@@ -82,13 +95,102 @@ class PiicoDev_BME280:
             sleep_time += 575+(2300*(1<<self.p_mode))
         if self.h_mode in [1, 2, 3, 4, 5]:
             sleep_time += 575+(2300*(1<<self.h_mode))
-        sleep_ms(1+sleep_time//1000)
+        return sleep_time
+
+    # Selects the power mode: 0 sleep, 1 forced (the default, one measurement per read) or 3 normal.
+    # In normal mode the sensor measures continuously, resting for the t_sb standby setting (0-7, 0.5ms to 1000ms)
+    # between measurements, and reads return the latest measurement without waiting. iir sets the filter coefficient (0-4)
+    def set_mode(self, mode, t_sb=None, iir=None):
+        if t_sb is not None:
+            self.t_sb = t_sb
+        if iir is not None:
+            self.iir = iir
+        self._write8(0xF4, self._ctrl_meas(_MODE_SLEEP)) # config is only guaranteed to be written in sleep mode
+        self._write8(0xF5, self.t_sb<<5 | self.iir<<2)
+        self._write8(0xF2, self.h_mode)
+        self.mode = mode
+        self._conversion_started = None
+        self._last_index = None
+        if mode == _MODE_NORMAL:
+            self._write8(0xF4, self._ctrl_meas(_MODE_NORMAL))
+            self._normal_started = ticks_ms()
+
+    # Starts a forced mode measurement and returns immediately. Collect the result with try_read()
+    def start_conversion(self):
+        self._write8(0xF4, self._ctrl_meas(_MODE_FORCED))
+        self._conversion_started = ticks_ms()
+
+    # Returns (temperature, pressure, humidity) in the units of values() once the measurement started by start_conversion()
+    # has finished, otherwise None. Never waits. In normal mode, returns each new measurement once
+    def try_read(self):
+        if self.mode == _MODE_NORMAL:
+            schedule = self._normal_schedule()
+            if schedule is None or schedule[0] == self._last_index:
+                return None
+            self._last_index = schedule[0]
+            return self.values()
+        if self._conversion_started is None:
+            return None
+        if ticks_diff(ticks_ms(), self._conversion_started) < self._measurement_time_us()//1000 or self._read8(0xF3) & 0x08:
+            return None
+        self._conversion_started = None
+        self._read_data_into(self._buf)
+        self._last = self._values(*self.compensate(*self._unpack(self._buf)))
+        return self._last
+
+    # The latest measurement without waiting, as (temperature, pressure, humidity, age_ms) in the units of values(), where
+    # age_ms is roughly how long ago the sensor finished it. Normal mode reads the sensor; other modes return the last
+    # result read. None if there is no measurement yet
+    def read_latest(self):
+        if self.mode == _MODE_NORMAL:
+            if self._normal_schedule() is None:
+                return None
+            self.values()
+        elif self._last is None:
+            return None
+        return self._last + (ticks_diff(ticks_ms(), self._read_ms) + self._read_age,)
+
+    # (measurement number, ms since it finished) of the latest normal mode measurement, estimated from the measurement
+    # and standby times. None before the first has finished
+    def _normal_schedule(self):
+        measure_ms = self._measurement_time_us()/1000
+        period = measure_ms + _T_SB_MS[self.t_sb]
+        elapsed = ticks_diff(ticks_ms(), self._normal_started) - measure_ms
+        if elapsed < 0:
+            return None
+        index = int(elapsed // period)
+        return (index, elapsed - index * period)
+
+    # Reads the 8 data registers (0xF7 to 0xFE) into buf in one burst and notes how old the measurement is
+    def _read_data_into(self, buf):
+        self.i2c.readfrom_mem_into(self.addr, _REG_DATA, buf)
+        self._read_ms = ticks_ms()
+        schedule = self._normal_schedule() if self.mode == _MODE_NORMAL else None
+        self._read_age = int(schedule[1]) if schedule is not None else 0
+        return buf
+
+    # Measures (in forced mode) and reads the 8 data registers into buf in one burst. Returns buf
+    def read_raw_into(self, buf):
+        self._measure()
+        return self._read_data_into(buf)
+
+    def _unpack(self, buf):
+        raw_p = ((buf[0]<<16)|(buf[1]<<8)|buf[2])>>4
+        raw_t = ((buf[3]<<16)|(buf[4]<<8)|buf[5])>>4
+        raw_h = (buf[6] << 8)| buf[7]
+        return (raw_t, raw_p, raw_h)
+
+    def read_raw_data(self):
+        return self._unpack(self.read_raw_into(self._buf))
+
+    def _measure(self):
+        if self.mode == _MODE_NORMAL: # the data registers always hold the latest measurement
+            return
+        self.start_conversion()
+        sleep_ms(1+self._measurement_time_us()//1000)
         while(self._read16(0xF3) & 0x08):
             sleep_ms(1)
-        raw_p = ((self._read8(0xF7)<<16)|(self._read8(0xF8)<<8)|self._read8(0xF9))>>4
-        raw_t = ((self._read8(0xFA)<<16)|(self._read8(0xFB)<<8)|self._read8(0xFC))>>4
-        raw_h = (self._read8(0xFD) << 8)| self._read8(0xFE)
-        return (raw_t, raw_p, raw_h)
+        self._conversion_started = None
 
     def read_compensated_data(self):
         try:
@@ -96,6 +198,10 @@ class PiicoDev_BME280:
         except:
             print(i2c_err_str.format(self.addr))
             return (float('NaN'), float('NaN'), float('NaN'))
+        return self.compensate(raw_t, raw_p, raw_h)
+
+    # Bosch integer compensation of one raw reading. Returns (temperature [0.01 degC], pressure [Pa/256], humidity [%RH/1024])
+    def compensate(self, raw_t, raw_p, raw_h):
         var1 = ((raw_t>>3)-(self._T1<<1))*(self._T2>>11)
         var2 = (raw_t >> 4)-self._T1
         var2 = var2*((raw_t>>4)-self._T1)
@@ -128,10 +234,60 @@ class PiicoDev_BME280:
         humi = h>>12
         return (temp, pres, humi)
 
-    def values(self):
-        temp, pres, humi = self.read_compensated_data()
+    # Compensates sequences of raw readings (eg. logged from read_raw_data()) with the Bosch double precision formulas.
+    # Returns (temperature [degC], pressure [Pa], humidity [%RH]) as NumPy arrays when NumPy is installed, otherwise lists
+    def compensate_batch(self, raw_t, raw_p, raw_h):
+        if numpy is not None:
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                t, p, h = self._compensate_double(numpy.asarray(raw_t, dtype=numpy.float64), numpy.asarray(raw_p, dtype=numpy.float64), numpy.asarray(raw_h, dtype=numpy.float64))
+            return (t, p, h)
+        temps = []
+        pressures = []
+        humidities = []
+        for raw in zip(raw_t, raw_p, raw_h):
+            t, p, h = self._compensate_double(float(raw[0]), float(raw[1]), float(raw[2]))
+            temps.append(t)
+            pressures.append(p)
+            humidities.append(h)
+        return (temps, pressures, humidities)
+
+    # Works on floats or NumPy arrays alike. The temperature term scales by T2>>11, as compensate() does, so batch
+    # results agree with live readings
+    def _compensate_double(self, raw_t, raw_p, raw_h):
+        var1 = (raw_t/8.0-self._T1*2.0)*(self._T2>>11)
+        var2 = raw_t/131072.0-self._T1/8192.0
+        t_fine = var1+var2*var2*self._T3
+        temp = t_fine/5120.0
+        var1 = t_fine/2.0-64000.0
+        var2 = var1*var1*self._P6/32768.0
+        var2 = var2+var1*self._P5*2.0
+        var2 = var2/4.0+self._P4*65536.0
+        var1 = (self._P3*var1*var1/524288.0+self._P2*var1)/524288.0
+        var1 = (1.0+var1/32768.0)*self._P1
+        if numpy is not None and isinstance(var1, numpy.ndarray):
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                p = (1048576.0-raw_p-var2/4096.0)*6250.0/var1
+                p = p+(self._P9*p*p/2147483648.0+p*self._P8/32768.0+self._P7)/16.0
+            p = numpy.where(var1 == 0, 0.0, p)
+        elif var1 == 0: # avoid division by zero, as compensate() does
+            p = 0.0
+        else:
+            p = (1048576.0-raw_p-var2/4096.0)*6250.0/var1
+            p = p+(self._P9*p*p/2147483648.0+p*self._P8/32768.0+self._P7)/16.0
+        h = t_fine-76800.0
+        h = (raw_h-(self._H4*64.0+self._H5/16384.0*h))*(self._H2/65536.0*(1.0+self._H6/67108864.0*h*(1.0+self._H3/67108864.0*h)))
+        h = h*(1.0-self._H1*h/524288.0)
+        if numpy is not None and isinstance(h, numpy.ndarray):
+            return (temp, p, numpy.clip(h, 0.0, 100.0))
+        return (temp, p, min(max(h, 0.0), 100.0))
+
+    def _values(self, temp, pres, humi):
         return (temp/100, pres/256,  humi/1024)
 
+    def values(self):
+        self._last = self._values(*self.read_compensated_data())
+        return self._last
+
     def pressure_precision(self):
         p = self.read_compensated_data()[1]
         pi = float(p // 256)
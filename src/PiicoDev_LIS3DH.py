@@ -13,11 +13,12 @@ v1.0.0 rc
 
 from PiicoDev_Unified import *
 from math import atan2, pi, sqrt
+from array import array
 try:
-    from ustruct import pack, unpack
+    from ustruct import pack, unpack, unpack_from
     from ucollections import namedtuple
 except:
-    from struct import pack, unpack
+    from struct import pack, unpack, unpack_from
     from collections import namedtuple
 
 _R_WHOAMI = 0x0F
@@ -28,7 +29,10 @@ _CTRL_REG_1 = 0x20
 _CTRL_REG_2 = 0x21
 _CTRL_REG_3 = 0x22
 _CTRL_REG_4 = 0x23
-_CTRL_REG_5 = 0x25
+_CTRL_REG_5 = 0x24
+_CTRL_REG_6 = 0x25
+_FIFO_CTRL_REG = 0x2E
+_FIFO_SRC_REG = 0x2F
 _INT1_SRC = 0x31
 _CLICK_CFG = 0x38
 _CLICKSRC = 0x39
@@ -38,13 +42,24 @@ _TIME_LATENCY=0x3C
 _TIME_WINDOW = 0x3D
 _STATUS_REG = 0x27
 
+# FIFO modes for set_fifo()
+FIFO_BYPASS = 0 # FIFO off, only the output registers are updated
+FIFO_MODE = 1 # fill the FIFO then stop collecting samples until it is reset
+FIFO_STREAM = 2 # keep the newest 32 samples, discarding the oldest
+FIFO_STREAM_TO_FIFO = 3 # stream until interrupt 1 fires, then FIFO mode
+
+_FIFO_SIZE = 32 # [samples]
+_DIVISORS = {2:1670.295, 4:835.1476, 8:417.6757, 16:139.1912} # (LSB/1g) / 9.80665
+_RAD2DEG = 180/pi
+
 compat_str = '\nUnified PiicoDev library out of date.  Get the latest module: https://piico.dev/unified \n'
 
 AccelerationTuple = namedtuple("acceleration", ("x", "y", "z"))
 AngleTuple = namedtuple("angle",("x","y","z"))
+FifoStatusTuple = namedtuple("fifo_status", ("count", "watermark", "overrun"))
 
 def rad2deg(x):
-    return x * 180/pi
+    return x * _RAD2DEG
     
 def _set_bit(x, n):
     return x | (1 << n)
@@ -75,7 +90,7 @@ def signed_int_from_bytes(x, endian='big'):
 class PiicoDev_LIS3DH(object):    
     def __init__(self, bus=None, freq=None, sda=None, scl=None, address=_I2C_ADDRESS, asw=None, range=2, rate=400):
         try:
-            if compat_ind >= 1: pass
+            if compat_ind >= 2: pass
             else: print(compat_str)
         except: print(compat_str)
         
@@ -93,6 +108,9 @@ class PiicoDev_LIS3DH(object):
             d = 0x88 # Block Data Update an High Resolution Mode
             x = int.to_bytes(d,1,'big')
             self._write(_CTRL_REG_4, x)
+            self._fifo_buf = bytearray(6 * _FIFO_SIZE)
+            self._sample_buf = bytearray(6)
+            self.fifo_overrun = False
             self.range = range
             self.rate = rate
         except Exception as e:
@@ -125,6 +143,7 @@ class PiicoDev_LIS3DH(object):
         val = _write_crumb(val, 4, rr) # Write new range code
         self._write(_CTRL_REG_4, int.to_bytes(val,1,'big'))
         self._range = r
+        self._divisor = _DIVISORS[r]
     
     @property
     def rate(self):
@@ -133,12 +152,18 @@ class PiicoDev_LIS3DH(object):
     
     @rate.setter
     def rate(self, r):
-        """Set the data rate [Hz]. Valid rates are 1, 10, 25, 50, 100, 200, 400"""
-        valid_rates = {0:0b0000, 1:0b0001, 10:0b0010, 25:0b0011, 50:0b0100, 100:0b0101, 200:0b0110, 400:0b0111} # key:value -> rate[Hz] : binary code for register
+        """Set the data rate [Hz]. Valid rates are 1, 10, 25, 50, 100, 200, 400, 1344, 1600, 5376.
+        1600 and 5376 are only available in low power (8-bit) mode, which is selected automatically"""
+        valid_rates = {0:0b0000, 1:0b0001, 10:0b0010, 25:0b0011, 50:0b0100, 100:0b0101, 200:0b0110, 400:0b0111, 1344:0b1001, 1600:0b1000, 5376:0b1001} # key:value -> rate[Hz] : binary code for register
         try: rr = valid_rates[r]
-        except(KeyError): raise ValueError("rate must be one of 0, 1, 10, 25, 50, 100, 200, or 400")
+        except(KeyError): raise ValueError("rate must be one of 0, 1, 10, 25, 50, 100, 200, 400, 1344, 1600 or 5376")
+        low_power = r in (1600, 5376)
+        val = self._read(_CTRL_REG_4, 1)
+        val = _write_bit(val, 3, not low_power) # High Resolution Mode, not allowed in low power mode
+        self._write(_CTRL_REG_4, int.to_bytes(val,1,'big'))
         val = self._read(_CTRL_REG_1, 1)  # Get value from register
         val &= 0x0F # mask off last 4 bits
+        val = _write_bit(val, 3, low_power) # LPen
         val = val | rr << 4
         self._write(_CTRL_REG_1, int.to_bytes(val,1,'little'))
         self._rate = r
@@ -146,20 +171,41 @@ class PiicoDev_LIS3DH(object):
     @property
     def acceleration(self):
         """Return x,y,z acceleration in a 3-tuple. unit: :math:`m/s^2"""
-        d = self._read(_OUT_X_L | 0x80, 6, bytestring=True)
-        x,y,z = unpack('<hhh', d)
-        divisors = {2:1670.295, 4:835.1476, 8:417.6757, 16:139.1912} # (LSB/1g) / 9.80665
-        den = divisors[self.range]
-        x = x/den; y=y/den; z=z/den;
-        return AccelerationTuple(x, y, z)
-        
+        if not self._read_sample():
+            return AccelerationTuple(float('NaN'), float('NaN'), float('NaN'))
+        x,y,z = unpack_from('<hhh', self._sample_buf)
+        den = self._divisor
+        return AccelerationTuple(x/den, y/den, z/den)
+
+    def read_into(self, buf, raw=False):
+        """Read x,y,z acceleration into the first three items of buf, without allocating a tuple per sample.
+        raw=False: buf is an array('f') (or list), unit m/s^2. On MicroPython each scaled value is still a boxed float
+        raw=True: buf is an array('h') (or list) of 16-bit left justified values. Integer only, so this is the path that
+        doesn't trigger the GC. Divide by _DIVISORS[range] for m/s^2 (about 16380 LSB/g at 2g, 8190 at 4g, 4096 at 8g, 1365 at 16g)
+        Returns False if the read failed"""
+        if not self._read_sample():
+            return False
+        b = self._sample_buf
+        x = b[0] | b[1] << 8
+        y = b[2] | b[3] << 8
+        z = b[4] | b[5] << 8
+        if x & 0x8000: x -= 0x10000
+        if y & 0x8000: y -= 0x10000
+        if z & 0x8000: z -= 0x10000
+        if raw:
+            buf[0] = x; buf[1] = y; buf[2] = z
+        else:
+            den = self._divisor
+            buf[0] = x/den; buf[1] = y/den; buf[2] = z/den
+        return True
+
     @property    
     def angle(self):
         """Return 3-axis tilt angle in degrees"""
         x,y,z = self.acceleration
-        ay = rad2deg(atan2(z,x))
-        az = rad2deg(atan2(x,y))
-        ax = rad2deg(atan2(y,z))
+        ay = atan2(z,x) * _RAD2DEG
+        az = atan2(x,y) * _RAD2DEG
+        ax = atan2(y,z) * _RAD2DEG
         return AngleTuple(ax,ay,az)
 
     def set_tap(self, tap, threshold=40, time_limit=10, latency=80, window=255, click_cfg=None):
@@ -180,7 +226,7 @@ class PiicoDev_LIS3DH(object):
         ctrl3 = self._read(_CTRL_REG_3,1)
         ctrl3 = _set_bit(ctrl3,7) # Enable INT1 CLICK
         self._write(_CTRL_REG_3, int.to_bytes(ctrl3,1,'big'))
-        self._write(_CTRL_REG_5, b'\x08') # Latch INT1
+        self._write(_CTRL_REG_6, b'\x08') # I2_ACT. The click interrupt is latched by LIR_Click in CLICK_THS below
         
         # Could use dict, similar to range and rate properties
         if tap == 1:
@@ -229,6 +275,67 @@ class PiicoDev_LIS3DH(object):
         total_accel = sqrt(sum(map(lambda x: x * x, avg)))
         return total_accel > threshold
 
+    def set_fifo(self, mode=FIFO_STREAM, watermark=16):
+        """Configure the 32 sample FIFO. mode is FIFO_BYPASS (off), FIFO_MODE, FIFO_STREAM or FIFO_STREAM_TO_FIFO.
+        fifo_status.watermark is set once more than watermark (0-31) samples are waiting"""
+        if not mode in [FIFO_BYPASS, FIFO_MODE, FIFO_STREAM, FIFO_STREAM_TO_FIFO]:
+            raise ValueError("mode must be FIFO_BYPASS, FIFO_MODE, FIFO_STREAM or FIFO_STREAM_TO_FIFO")
+        if watermark > 31 or watermark < 0:
+            raise ValueError("watermark out of range (0-31)")
+        self._write(_FIFO_CTRL_REG, b'\x00') # pass through bypass mode to empty the FIFO
+        val = self._read(_CTRL_REG_5, 1)
+        val = _write_bit(val, 6, mode != FIFO_BYPASS) # FIFO_EN
+        self._write(_CTRL_REG_5, int.to_bytes(val,1,'big'))
+        if mode != FIFO_BYPASS:
+            self._write(_FIFO_CTRL_REG, int.to_bytes(mode << 6 | watermark,1,'big'))
+        self.fifo_overrun = False
+
+    @property
+    def fifo_status(self):
+        """Return the number of samples waiting in the FIFO, and whether the watermark was reached and samples were overwritten"""
+        src = self._read(_FIFO_SRC_REG, 1)
+        overrun = _read_bit(src, 6)
+        count = _FIFO_SIZE if overrun else src & 0x1F
+        return FifoStatusTuple(count, _read_bit(src, 7), overrun)
+
+    def read_fifo_into(self, buf):
+        """Drain the FIFO in one burst read into buf, an array('h') of raw x,y,z values (16-bit, left justified).
+        Returns the number of samples read, at most len(buf)//3. fifo_overrun is set if samples were lost before this read"""
+        n = min(self.fifo_status.count, len(buf) // 3)
+        # array('h') is little endian on every supported board, like the output registers, so no conversion is needed
+        if not self._burst_fifo(memoryview(buf)[:3 * n], n):
+            return 0
+        return n
+
+    def read_fifo(self):
+        """Drain the FIFO in one burst read. Returns an array('h') of raw x,y,z values (16-bit, left justified)"""
+        return array('h', self._drain_fifo(self.fifo_status.count))
+
+    def _drain_fifo(self, n):
+        if not self._burst_fifo(memoryview(self._fifo_buf)[:6 * n], n):
+            return ()
+        return unpack_from('<' + str(3 * n) + 'h', self._fifo_buf)
+
+    def _burst_fifo(self, buf, n):
+        self.fifo_overrun = n >= _FIFO_SIZE
+        if n == 0:
+            return False
+        try:
+            # Auto-increment wraps from OUT_Z_H back to OUT_X_L while the FIFO is enabled, so every sample comes in one read
+            self.i2c.readfrom_mem_into(self.address, _OUT_X_L | 0x80, buf)
+        except:
+            print("Error reading from LIS3DH at address 0x{:02x}".format(self.address))
+            return False
+        return True
+
+    def _read_sample(self):
+        try:
+            self.i2c.readfrom_mem_into(self.address, _OUT_X_L | 0x80, self._sample_buf)
+        except:
+            print("Error reading from LIS3DH at address 0x{:02x}".format(self.address))
+            return False
+        return True
+
     def _read(self, reg, N, bytestring=False):
         try:
             reg |= 0x80 # bit 7 enables address auto-increment (esoteric feature specific to LIS3DH)
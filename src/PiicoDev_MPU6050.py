@@ -4,6 +4,13 @@
 
 from PiicoDev_Unified import *
 from math import sqrt, atan2
+from array import array
+try:
+    from ustruct import unpack_from
+    from ucollections import namedtuple
+except:
+    from struct import unpack_from
+    from collections import namedtuple
 
 compat_str = '\nUnified PiicoDev library out of date.  Get the latest module: https://piico.dev/unified \n'
 
@@ -32,9 +39,19 @@ _GYR_RNG_500DEG = 0x08
 _GYR_RNG_1000DEG = 0x10
 _GYR_RNG_2000DEG = 0x18
 
+_ACC_SCLR = {_ACC_RNG_2G:_ACC_SCLR_2G, _ACC_RNG_4G:_ACC_SCLR_4G, _ACC_RNG_8G:_ACC_SCLR_8G, _ACC_RNG_16G:_ACC_SCLR_16G}
+_GYR_SCLR = {_GYR_RNG_250DEG:_GYR_SCLR_250DEG, _GYR_RNG_500DEG:_GYR_SCLR_500DEG, _GYR_RNG_1000DEG:_GYR_SCLR_1000DEG, _GYR_RNG_2000DEG:_GYR_SCLR_2000DEG}
+
 # MPU-6050 Registers
 _PWR_MGMT_1 = 0x6B
 
+_SMPLRT_DIV = 0x19
+_CONFIG = 0x1A
+_FIFO_EN = 0x23
+_USER_CTRL = 0x6A
+_FIFO_COUNTH = 0x72
+_FIFO_R_W = 0x74
+
 _ACCEL_XOUT0 = 0x3B
 
 _TEMP_OUT0 = 0x41
@@ -44,6 +61,14 @@ _GYRO_XOUT0 = 0x43
 _ACCEL_CONFIG = 0x1C
 _GYRO_CONFIG = 0x1B
 
+# FIFO
+_FIFO_EN_TEMP_GYRO_ACCEL = 0xF8 # TEMP_FIFO_EN, XG, YG, ZG and ACCEL_FIFO_EN
+_USER_CTRL_FIFO_EN = 0x40
+_USER_CTRL_FIFO_RESET = 0x04
+_FIFO_SIZE = 1024 # [bytes]
+_FIFO_SAMPLE_BYTES = 14 # accel x, y, z, temperature, gyro x, y, z. Same order as registers 0x3B-0x48
+_FIFO_RESYNC_MS = 20 # re-anchor FIFO timestamps to ticks_ms() when they drift further than this (or two sample periods)
+
 _maxFails = 3
 
 # Address
@@ -55,6 +80,14 @@ def signedIntFromBytes(x, endian='big'):
         return -((65535 - y) + 1)
     else:
         return y
+
+# One sample of every sensor from read_all()
+ImuTuple = namedtuple("ImuTuple", ("ax", "ay", "az", "temperature", "gx", "gy", "gz"))
+
+# A block of samples drained from the FIFO. samples holds 7 values per sample: accel x, y, z, temperature, gyro x, y, z.
+# timestamp_ms is the ticks_ms() the first sample was taken at, and sample i was taken i*period_ms [float] later, so
+# ticks_add(timestamp_ms, round(i*period_ms)) is its ticks_ms(). overflow is True if samples were lost before this block
+FifoData = namedtuple("FifoData", ("samples", "count", "timestamp_ms", "period_ms", "overflow"))
     
 
 class PiicoDev_MPU6050(object):     
@@ -62,7 +95,7 @@ class PiicoDev_MPU6050(object):
         self._failCount = 0
         self._terminatingFailCount = 0
         try:
-            if compat_ind >= 1:
+            if compat_ind >= 2:
                 pass
             else:
                 print(compat_str)
@@ -79,15 +112,22 @@ class PiicoDev_MPU6050(object):
             raise e
         self._accel_range = self.get_accel_range(True)
         self._gyro_range = self.get_gyro_range(True)
+        self._dlpf = 0
+        self._sample_buf = bytearray(_FIFO_SAMPLE_BYTES)
+        self._fifo_buf = None
+        self._fifo_period_ms = None
+        self._fifo_running = False
+        self._fifo_time = None # ticks_ms() of the next sample expected from the FIFO
+        self._fifo_frac = 0.0 # and the fraction of a millisecond on top of it
 
     def _readData(self, register):
         failCount = 0
         while failCount < _maxFails:
             try:
-                sleep_ms(10)
                 data = self.i2c.readfrom_mem(self.addr, register, 6)
                 break
             except:
+                sleep_ms(10)
                 failCount = failCount + 1
                 self._failCount = self._failCount + 1
                 if failCount >= _maxFails:
@@ -221,8 +261,115 @@ class PiicoDev_MPU6050(object):
 
         return {'x': x, 'y': y, 'z': z}
 
+    # Reads accel, temperature and gyro (registers 0x3B-0x48) in a single burst. Returns an ImuTuple:
+    # raw=True: register values
+    # raw=False: acceleration in m/s^2 (or g when g=True), temperature in degC and rotation in deg/s
+    def read_all(self, raw=False, g=False):
+        try:
+            self.i2c.readfrom_mem_into(self.addr, _ACCEL_XOUT0, self._sample_buf)
+        except:
+            print(i2c_err_str.format(self.addr))
+            nan = float('NaN')
+            return ImuTuple(nan, nan, nan, nan, nan, nan, nan)
+        ax, ay, az, t, gx, gy, gz = unpack_from('>7h', self._sample_buf)
+        if raw:
+            return ImuTuple(ax, ay, az, t, gx, gy, gz)
+        accel = _ACC_SCLR.get(self._accel_range, _ACC_SCLR_2G)
+        if not g:
+            accel = accel / _GRAVITIY_MS2
+        gyro = _GYR_SCLR.get(self._gyro_range, _GYR_SCLR_250DEG)
+        return ImuTuple(ax / accel, ay / accel, az / accel, t / 340 + 36.53, gx / gyro, gy / gyro, gz / gyro)
+
     def read_angle(self): # returns radians. orientation matches silkscreen
         a=self.read_accel_data()
         x=atan2(a['y'],a['z'])
         y=atan2(-a['x'],a['z'])
-        return {'x': x, 'y': y}
\ No newline at end of file
+        return {'x': x, 'y': y}
+
+    # Sets the digital low pass filter, 0 to 6 (DLPF_CFG). 0 and 7 disable it and run the gyro at 8kHz instead of 1kHz
+    def set_dlpf(self, dlpf):
+        self.i2c.writeto_mem(self.addr, _CONFIG, bytes([dlpf & 0x07]))
+        self._dlpf = dlpf & 0x07
+
+    # Sets the sample rate [Hz] of the data registers and FIFO through the sample rate divider. Returns the rate actually set
+    def set_sample_rate(self, rate):
+        gyro_rate = 8000 if self._dlpf in (0, 7) else 1000
+        divider = min(max(int(round(gyro_rate / rate)) - 1, 0), 255)
+        self.i2c.writeto_mem(self.addr, _SMPLRT_DIV, bytes([divider]))
+        self._fifo_period_ms = (divider + 1) * 1000 / gyro_rate
+        return gyro_rate / (divider + 1)
+
+    # Streams accel, temperature and gyro samples into the on-chip FIFO at rate [Hz]. Drain it with read_fifo() often enough
+    # that it doesn't fill: it holds 73 samples, eg. 73ms at 1kHz. Returns the sample rate actually set
+    def start_fifo(self, rate=1000, dlpf=1):
+        self.set_dlpf(dlpf)
+        rate = self.set_sample_rate(rate)
+        if self._fifo_buf is None:
+            self._fifo_buf = bytearray(_FIFO_SIZE - _FIFO_SIZE % _FIFO_SAMPLE_BYTES)
+        self.i2c.writeto_mem(self.addr, _FIFO_EN, bytes([_FIFO_EN_TEMP_GYRO_ACCEL]))
+        self.reset_fifo()
+        self._fifo_running = True
+        return rate
+
+    def stop_fifo(self):
+        self.i2c.writeto_mem(self.addr, _FIFO_EN, bytes([0x00]))
+        self.i2c.writeto_mem(self.addr, _USER_CTRL, bytes([0x00]))
+        self._fifo_running = False
+        self._fifo_time = None
+
+    # Empties the FIFO and keeps it running
+    def reset_fifo(self):
+        self.i2c.writeto_mem(self.addr, _USER_CTRL, bytes([_USER_CTRL_FIFO_RESET]))
+        self.i2c.writeto_mem(self.addr, _USER_CTRL, bytes([_USER_CTRL_FIFO_EN]))
+        self._fifo_time = None
+
+    # Number of bytes waiting in the FIFO
+    def fifo_count(self):
+        data = self.i2c.readfrom_mem(self.addr, _FIFO_COUNTH, 2)
+        return (data[0] << 8) | data[1]
+
+    # Drains every complete sample from the FIFO in one burst read. Returns FifoData with samples in an array:
+    # raw=True: array('h') of register values
+    # raw=False: array('f') of acceleration in m/s^2 (or g when g=True), temperature in degC and rotation in deg/s
+    # If the FIFO filled up it is reset, because samples are no longer aligned, and an empty block with overflow=True is returned
+    def read_fifo(self, raw=False, g=False):
+        if not self._fifo_running:
+            raise RuntimeError('FIFO is not running, call start_fifo() first')
+        now = ticks_ms()
+        count = self.fifo_count()
+        period = self._fifo_period_ms
+        if count >= _FIFO_SIZE:
+            self.reset_fifo()
+            return FifoData(array('h') if raw else array('f'), 0, now, period, True)
+        n = count // _FIFO_SAMPLE_BYTES
+        length = n * _FIFO_SAMPLE_BYTES
+        if n > 0:
+            self.i2c.readfrom_mem_into(self.addr, _FIFO_R_W, memoryview(self._fifo_buf)[:length])
+        values = unpack_from('>' + str(7 * n) + 'h', self._fifo_buf)
+        if raw:
+            samples = array('h', values)
+        else:
+            samples = array('f', values)
+            accel = _ACC_SCLR.get(self._accel_range, _ACC_SCLR_2G)
+            if not g:
+                accel = accel / _GRAVITIY_MS2
+            gyro = _GYR_SCLR.get(self._gyro_range, _GYR_SCLR_250DEG)
+            for i in range(0, 7 * n, 7):
+                samples[i] /= accel
+                samples[i + 1] /= accel
+                samples[i + 2] /= accel
+                samples[i + 3] = samples[i + 3] / 340 + 36.53
+                samples[i + 4] /= gyro
+                samples[i + 5] /= gyro
+                samples[i + 6] /= gyro
+        # The last sample was taken just before now. Timestamps carry on from the previous block unless they have drifted
+        anchored = ticks_add(now, -int(round((n - 1) * period)))
+        timestamp = self._fifo_time
+        if timestamp is None or abs(ticks_diff(timestamp, anchored)) > max(_FIFO_RESYNC_MS, 2 * period):
+            timestamp = anchored
+            self._fifo_frac = 0.0
+        if n > 0:
+            elapsed = self._fifo_frac + n * period
+            self._fifo_time = ticks_add(timestamp, int(elapsed))
+            self._fifo_frac = elapsed - int(elapsed)
+        return FifoData(samples, n, timestamp, period, False)
@@ -33,6 +33,8 @@ class PiicoDev_MS5637(object):
     _MS5637_CONV_TIME_OSR_2048 = 5 # 0.005
     _MS5637_CONV_TIME_OSR_4096 = 9 # 0.009
     _MS5637_CONV_TIME_OSR_8192 = 17 # 0.017
+    _CONV_TIME = (_MS5637_CONV_TIME_OSR_256, _MS5637_CONV_TIME_OSR_512, _MS5637_CONV_TIME_OSR_1024,
+                  _MS5637_CONV_TIME_OSR_2048, _MS5637_CONV_TIME_OSR_4096, _MS5637_CONV_TIME_OSR_8192)
     
     # MS5637 commands resolution 
     _RESOLUTION_OSR_256 = 0
@@ -50,14 +52,10 @@ class PiicoDev_MS5637(object):
     _MS5637_TEMP_COEFF_OF_PRESSURE_OFFSET_INDEX = 4
     _MS5637_REFERENCE_TEMPERATURE_INDEX = 5
     _MS5637_TEMP_COEFF_OF_TEMPERATURE_INDEX = 6
-    
-    eeprom_coeff = [0,0,0,0,0,0,0,0]
-    
-    coeff_valid = False
 
     def __init__(self, bus=None, freq=None, sda=None, scl=None, addr = _I2C_ADDRESS):
         try:
-            if compat_ind >= 1:
+            if compat_ind >= 2:
                 pass
             else:
                 print(compat_str)
@@ -65,6 +63,10 @@ class PiicoDev_MS5637(object):
             print(compat_str)
         self.i2c = create_unified_i2c(bus=bus, freq=freq, sda=sda, scl=scl)
         self.addr = addr
+        self.eeprom_coeff = [0,0,0,0,0,0,0,0]
+        self.coeff_valid = False
+        self._prom_read = False
+        self._conversion_started = 0
         #try:
         self.i2c.write8(self.addr, None, bytes([self._SOFTRESET]))
         sleep_ms(15)
@@ -75,20 +77,8 @@ class PiicoDev_MS5637(object):
     # res : ms5637_resolution_osr : Resolution requested
     # return temperature command, pressure command, temperature conversion time, pressure conversion time 
     def set_resolution(self,res) :
-        time = [self._MS5637_CONV_TIME_OSR_256,
-        self._MS5637_CONV_TIME_OSR_512,
-        self._MS5637_CONV_TIME_OSR_1024,
-        self._MS5637_CONV_TIME_OSR_2048,
-        self._MS5637_CONV_TIME_OSR_4096,
-        self._MS5637_CONV_TIME_OSR_8192]
-        cmd_temp = res *2;
-        cmd_temp |= self._MS5637_START_TEMPERATURE_ADC_CONVERSION;
-        _time_temp = time[int((cmd_temp & self._MS5637_CONVERSION_OSR_MASK)/2)]
-        
-        cmd_pressure = res *2;
-        cmd_pressure |= self._MS5637_START_PRESSURE_ADC_CONVERSION;
-        _time_pressure = time[int((cmd_pressure & self._MS5637_CONVERSION_OSR_MASK)/2)]
-        return cmd_temp,cmd_pressure, _time_temp, _time_pressure
+        _time = self._CONV_TIME[res]
+        return self._MS5637_START_TEMPERATURE_ADC_CONVERSION | res*2, self._MS5637_START_PRESSURE_ADC_CONVERSION | res*2, _time, _time
 
     # Read eeprom coefficients
     # cmd : address of coefficient in EEPROM
@@ -97,6 +87,7 @@ class PiicoDev_MS5637(object):
         return int.from_bytes(data, 'big')
 
     # Reads the ms5637 EEPROM coefficients to store them for computation.
+    # coeff_valid is set when their CRC-4 checks out, and the constant terms of the compensation are precomputed
     # Returns all coefficients read in the EEPROM 
     def read_eeprom(self) : 
         a = 0
@@ -112,9 +103,32 @@ class PiicoDev_MS5637(object):
         for i in liste :
             coeffs[a] = self.read_eeprom_coeff(i)
             a = a+1
-        self.coeff_valid = True
+        self.coeff_valid = self._crc4(coeffs) == coeffs[self._MS5637_CRC_INDEX] >> 12
+        self._sens_t1 = coeffs[self._MS5637_PRESSURE_SENSITIVITY_INDEX] << 16
+        self._off_t1 = coeffs[self._MS5637_PRESSURE_OFFSET_INDEX] << 17
+        self._tcs = coeffs[self._MS5637_TEMP_COEFF_OF_PRESSURE_SENSITIVITY_INDEX]
+        self._tco = coeffs[self._MS5637_TEMP_COEFF_OF_PRESSURE_OFFSET_INDEX]
+        self._t_ref = coeffs[self._MS5637_REFERENCE_TEMPERATURE_INDEX] << 8
+        self._tempsens = coeffs[self._MS5637_TEMP_COEFF_OF_TEMPERATURE_INDEX]
         return coeffs
 
+    # CRC-4 of the PROM (TE application note AN520, with the CRC held in the top 4 bits of word 0)
+    def _crc4(self, coeffs):
+        words = list(coeffs[:7]) + [0]
+        words[0] &= 0x0FFF
+        n_rem = 0
+        for cnt in range(16):
+            if cnt % 2 == 1:
+                n_rem ^= words[cnt >> 1] & 0x00FF
+            else:
+                n_rem ^= words[cnt >> 1] >> 8
+            for _ in range(8):
+                if n_rem & 0x8000:
+                    n_rem = ((n_rem << 1) ^ 0x3000) & 0xFFFF
+                else:
+                    n_rem = (n_rem << 1) & 0xFFFF
+        return (n_rem >> 12) & 0x000F
+
     # Triggers conversion and read ADC value
     # Cmd : Command used for conversion (will determine Temperature vs Pressure and osr)
     # _time : ms
@@ -126,30 +140,81 @@ class PiicoDev_MS5637(object):
         adc = int.from_bytes(data, 'big')
         return adc
   
-    # Read Temperature and Pressure, perform compensation
+    # Starts a conversion without waiting for it
+    def _start_conversion(self,cmd) :
+        self.i2c.write8(self.addr, None, bytes([cmd]))
+        self._conversion_started = ticks_ms()
+
+    # Reads the ADC once the conversion started by _start_conversion() has had _time ms (plus a tick) to finish
+    def _read_adc(self,_time) :
+        remaining = _time + 1 - ticks_diff(ticks_ms(), self._conversion_started)
+        if remaining > 0 :
+            sleep_ms(remaining)
+        data = self.i2c.readfrom_mem(self.addr, self._ADC_READ, 3)
+        return int.from_bytes(data, 'big')
+
+    # Stream readings as fast as the sensor allows. Temperature is only converted every temperature_every pressure
+    # samples, and each conversion is started straight after the previous ADC read so it runs while the caller
+    # handles the sample
     # res: resolution [ # ]
-    # returns Temperature [degC] and Pressure [hPa]
-    def read_temperature_and_pressure(self,res=_RESOLUTION_OSR_8192) :
-        if self.coeff_valid == False :
+    # yields Temperature [degC], Pressure [hPa] and the ticks_ms() time the pressure was read
+    def stream(self,res=_RESOLUTION_OSR_8192,temperature_every=10) :
+        if temperature_every < 1 :
+            raise ValueError("temperature_every must be 1 or more")
+        return self._stream(res,temperature_every)
+
+    def _stream(self,res,temperature_every) :
+        if not self._load_coefficients() :
+            return
+        _time = self._CONV_TIME[res]
+        cmd_temp = self._MS5637_START_TEMPERATURE_ADC_CONVERSION | res*2
+        cmd_pressure = self._MS5637_START_PRESSURE_ADC_CONVERSION | res*2
+        self._start_conversion(cmd_temp)
+        adc_temperature = self._read_adc(_time)
+        self._start_conversion(cmd_pressure)
+        count = 0
+        while True :
+            adc_pressure = self._read_adc(_time)
+            timestamp = ticks_ms()
+            count += 1
+            refresh = count % temperature_every == 0
+            self._start_conversion(cmd_temp if refresh else cmd_pressure)
+            TEMP, P = self._compensate(adc_temperature, adc_pressure)
+            yield TEMP / 100.0, P / 100.0, timestamp
+            if refresh :
+                adc_temperature = self._read_adc(_time)
+                self._start_conversion(cmd_pressure)
+
+    # Reads the PROM once per instance, and reports a CRC error once. Returns True if the coefficients are valid
+    def _load_coefficients(self):
+        if self._prom_read == False :
             self.eeprom_coeff = self.read_eeprom()
-        (cmd_temp, cmd_pressure,_time_temp,_time_pressure) = self.set_resolution(res)
-        try:
-            adc_temperature = self.conversion_read_adc(cmd_temp,_time_temp)
-            adc_pressure = self.conversion_read_adc(cmd_pressure,_time_pressure)
-        except:
-            print(i2c_err_str.format(self.addr))
-            return float('NaN'), float('NaN')
-        if ((type(adc_temperature) is not int) or (type(adc_pressure) is not int)):
-            return float('NaN'), float('NaN')
+            self._prom_read = True
+            if self.coeff_valid == False :
+                print('MS5637 PROM CRC error')
+        return self.coeff_valid
+
+    # Convert and read the raw ADC values
+    # res: resolution [ # ]
+    # returns D2 (temperature) and D1 (pressure) ADC values
+    def read_raw(self,res=_RESOLUTION_OSR_8192) :
+        _time = self._CONV_TIME[res]
+        adc_temperature = self.conversion_read_adc(self._MS5637_START_TEMPERATURE_ADC_CONVERSION | res*2,_time)
+        adc_pressure = self.conversion_read_adc(self._MS5637_START_PRESSURE_ADC_CONVERSION | res*2,_time)
+        return adc_temperature, adc_pressure
+
+    # Temperature and pressure from raw ADC values, in integer arithmetic
+    # returns Temperature [0.01 degC] and Pressure [Pa]
+    def _compensate(self, adc_temperature, adc_pressure) :
          # Difference between actual and reference temperature = D2 - Tref
-        dT = (adc_temperature) - (self.eeprom_coeff[self._MS5637_REFERENCE_TEMPERATURE_INDEX] * 0x100)
+        dT = adc_temperature - self._t_ref
          # Actual temperature = 2000 + dT * TEMPSENS
-        TEMP = 2000 + (dT * self.eeprom_coeff[self._MS5637_TEMP_COEFF_OF_TEMPERATURE_INDEX] >> 23);
+        TEMP = 2000 + (dT * self._tempsens >> 23)
          # Second order temperature compensation
         if TEMP < 2000 : 
             T2 = ( 3 * ( dT  * dT  ) ) >> 33
-            OFF2 = 61 * (TEMP - 2000) * (TEMP - 2000) / 16 
-            SENS2 = 29 * (TEMP - 2000) * (TEMP - 2000) / 16 
+            OFF2 = ( 61 * (TEMP - 2000) * (TEMP - 2000) ) >> 4
+            SENS2 = ( 29 * (TEMP - 2000) * (TEMP - 2000) ) >> 4
             if TEMP < -1500 :
                 OFF2 += 17 * (TEMP + 1500) * (TEMP + 1500) 
                 SENS2 += 9 * ((TEMP + 1500) * (TEMP + 1500))
@@ -159,19 +224,46 @@ class PiicoDev_MS5637(object):
             SENS2 = 0
 
         #  OFF = OFF_T1 + TCO * dT
-        OFF = ( (self.eeprom_coeff[self._MS5637_PRESSURE_OFFSET_INDEX]) << 17 ) + ( ( (self.eeprom_coeff[self._MS5637_TEMP_COEFF_OF_PRESSURE_OFFSET_INDEX]) * dT ) >> 6 ) 
-        OFF -= OFF2 ;
-
+        OFF = self._off_t1 + ( ( self._tco * dT ) >> 6 ) - OFF2
         # Sensitivity at actual temperature = SENS_T1 + TCS * dT
-        SENS = ( self.eeprom_coeff[self._MS5637_PRESSURE_SENSITIVITY_INDEX] * 0x10000 ) + ( (self.eeprom_coeff[self._MS5637_TEMP_COEFF_OF_PRESSURE_SENSITIVITY_INDEX] * dT) >> 7 ) 
-        SENS -= SENS2
+        SENS = self._sens_t1 + ( ( self._tcs * dT ) >> 7 ) - SENS2
         #  Temperature compensated pressure = D1 * SENS - OFF
-        P = ( ( (int(adc_pressure * SENS)) >> 21 ) - int(OFF) ) >> 15 
+        P = ( ( ( adc_pressure * SENS ) >> 21 ) - OFF ) >> 15 
+        return TEMP - T2, P
+
+    # Compensate raw ADC values read with read_raw()
+    # returns Temperature [degC] and Pressure [hPa]
+    def compensate(self, adc_temperature, adc_pressure) :
+        if not self._load_coefficients() :
+            return float('NaN'), float('NaN')
+        TEMP, P = self._compensate(adc_temperature, adc_pressure)
+        return TEMP / 100.0, P / 100.0
 
-        temperature = ( TEMP - T2 ) / 100.0
-        pressure = P / 100.0
+    # Compensate sequences of logged raw ADC values
+    # returns lists of Temperature [degC] and Pressure [hPa]
+    def compensate_batch(self, adc_temperatures, adc_pressures) :
+        if not self._load_coefficients() :
+            return [float('NaN')] * len(adc_temperatures), [float('NaN')] * len(adc_pressures)
+        temperatures = []
+        pressures = []
+        for adc_temperature, adc_pressure in zip(adc_temperatures, adc_pressures) :
+            TEMP, P = self._compensate(adc_temperature, adc_pressure)
+            temperatures.append(TEMP / 100.0)
+            pressures.append(P / 100.0)
+        return temperatures, pressures
 
-        return temperature, pressure
+    # Read Temperature and Pressure, perform compensation
+    # res: resolution [ # ]
+    # returns Temperature [degC] and Pressure [hPa]
+    def read_temperature_and_pressure(self,res=_RESOLUTION_OSR_8192) :
+        try:
+            if not self._load_coefficients() :
+                return float('NaN'), float('NaN')
+            adc_temperature, adc_pressure = self.read_raw(res)
+        except:
+            print(i2c_err_str.format(self.addr))
+            return float('NaN'), float('NaN')
+        return self.compensate(adc_temperature, adc_pressure)
     
     # res: resolution [ # ]
     # Returns the pressure [hPa]
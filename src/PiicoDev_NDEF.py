@@ -0,0 +1,221 @@
+# NDEF (NFC Data Exchange Format) messages for tags used with the PiicoDev RFID Module
+# Encodes and decodes Text, URI and MIME records, short and long records, multi-record
+# messages, and the TLV block that holds a message in NFC Forum Type 2 tag memory (NTAG).
+#
+# Example:
+#   message = encodeMessage([uriRecord('https://piico.dev'), textRecord('Hello')])
+#   records = decodeMessage(message)
+
+# Type Name Format
+TNF_EMPTY        = 0x00
+TNF_WELL_KNOWN   = 0x01
+TNF_MIME         = 0x02
+TNF_ABSOLUTE_URI = 0x03
+TNF_EXTERNAL     = 0x04
+TNF_UNKNOWN      = 0x05
+TNF_UNCHANGED    = 0x06
+
+# Record header flags
+_FLAG_MB = 0x80 # message begin
+_FLAG_ME = 0x40 # message end
+_FLAG_CF = 0x20 # chunk flag
+_FLAG_SR = 0x10 # short record, one byte payload length
+_FLAG_IL = 0x08 # ID length present
+
+# TLV blocks in Type 2 tag memory
+_TLV_NULL       = 0x00
+_TLV_NDEF       = 0x03
+_TLV_TERMINATOR = 0xFE
+
+_RTD_TEXT = b'T'
+_RTD_URI  = b'U'
+
+# URI identifier codes (NFC Forum URI RTD). Index is the code stored in the first payload byte
+_URI_PREFIXES = ('', 'http://www.', 'https://www.', 'http://', 'https://', 'tel:', 'mailto:', 'ftp://anonymous:anonymous@',
+                 'ftp://ftp.', 'ftps://', 'sftp://', 'smb://', 'nfs://', 'ftp://', 'dav://', 'news:', 'telnet://', 'imap:',
+                 'rtsp://', 'urn:', 'pop:', 'sip:', 'sips:', 'tftp:', 'btspp://', 'btl2cap://', 'btgoep://', 'tcpobex://',
+                 'irdaobex://', 'file://', 'urn:epc:id:', 'urn:epc:tag:', 'urn:epc:pat:', 'urn:epc:raw:', 'urn:epc:', 'urn:nfc:')
+
+def _bytes(value):
+    return bytes(value, 'utf8') if isinstance(value, str) else bytes(value)
+
+class Record(object):
+    def __init__(self, tnf=TNF_EMPTY, type=b'', payload=b'', id=b''):
+        self.tnf = tnf
+        self.type = _bytes(type)
+        self.payload = _bytes(payload)
+        self.id = _bytes(id)
+
+    # Encode the record. Short record format is used when the payload fits in 255 bytes
+    def encode(self, first=True, last=True):
+        header = self.tnf & 0x07
+        if first:
+            header |= _FLAG_MB
+        if last:
+            header |= _FLAG_ME
+        if self.id:
+            header |= _FLAG_IL
+        length = len(self.payload)
+        out = bytearray()
+        if length < 256:
+            out.append(header | _FLAG_SR)
+            out.append(len(self.type))
+            out.append(length)
+        else:
+            out.append(header)
+            out.append(len(self.type))
+            out.extend(bytes([length >> 24 & 0xFF, length >> 16 & 0xFF, length >> 8 & 0xFF, length & 0xFF]))
+        if self.id:
+            out.append(len(self.id))
+        out.extend(self.type)
+        out.extend(self.id)
+        out.extend(self.payload)
+        return bytes(out)
+
+    # Text of a Text record, otherwise None
+    def text(self):
+        if self.tnf != TNF_WELL_KNOWN or self.type != _RTD_TEXT or not self.payload:
+            return None
+        status = self.payload[0]
+        body = self.payload[1 + (status & 0x3F):]
+        try:
+            return body.decode('utf-16' if status & 0x80 else 'utf-8')
+        except:
+            return None
+
+    # Language code of a Text record, otherwise None
+    def language(self):
+        if self.tnf != TNF_WELL_KNOWN or self.type != _RTD_TEXT or not self.payload:
+            return None
+        return self.payload[1:1 + (self.payload[0] & 0x3F)].decode('utf-8')
+
+    # URI of a URI or absolute URI record, otherwise None
+    def uri(self):
+        if self.tnf == TNF_ABSOLUTE_URI:
+            return self.type.decode('utf-8')
+        if self.tnf != TNF_WELL_KNOWN or self.type != _RTD_URI or not self.payload:
+            return None
+        prefix = _URI_PREFIXES[self.payload[0]] if self.payload[0] < len(_URI_PREFIXES) else ''
+        return prefix + self.payload[1:].decode('utf-8')
+
+    def __eq__(self, other):
+        return isinstance(other, Record) and (self.tnf, self.type, self.payload, self.id) == (other.tnf, other.type, other.payload, other.id)
+
+    def __repr__(self):
+        return 'Record(tnf={}, type={!r}, payload={!r}, id={!r})'.format(self.tnf, self.type, self.payload, self.id)
+
+# Text record. Text is stored UTF-8 encoded
+def textRecord(text, language='en'):
+    language = _bytes(language)
+    return Record(TNF_WELL_KNOWN, _RTD_TEXT, bytes([len(language)]) + language + _bytes(text))
+
+# URI record. The longest matching prefix (eg. 'https://www.') is abbreviated to a single byte
+def uriRecord(uri):
+    code = 0
+    for i in range(1, len(_URI_PREFIXES)):
+        if uri.startswith(_URI_PREFIXES[i]) and len(_URI_PREFIXES[i]) > len(_URI_PREFIXES[code]):
+            code = i
+    return Record(TNF_WELL_KNOWN, _RTD_URI, bytes([code]) + _bytes(uri[len(_URI_PREFIXES[code]):]))
+
+# MIME record, eg. mimeRecord('application/json', '{"id":1}')
+def mimeRecord(mime_type, data):
+    return Record(TNF_MIME, mime_type, data)
+
+# Encode a list of records as an NDEF message
+def encodeMessage(records):
+    if isinstance(records, Record):
+        records = [records]
+    if len(records) == 0:
+        return Record().encode()
+    out = bytearray()
+    for i, record in enumerate(records):
+        out.extend(record.encode(i == 0, i == len(records) - 1))
+    return bytes(out)
+
+# Decode an NDEF message into a list of records. Chunked records are joined. Raises ValueError if the message is malformed
+def decodeMessage(data):
+    data = bytes(data)
+    records = []
+    chunk = None
+    i = 0
+    while i < len(data):
+        if i + 3 > len(data):
+            raise ValueError('truncated NDEF record')
+        header = data[i]
+        type_length = data[i + 1]
+        i += 2
+        if header & _FLAG_SR:
+            payload_length = data[i]
+            i += 1
+        else:
+            if i + 4 > len(data):
+                raise ValueError('truncated NDEF record')
+            payload_length = (data[i] << 24) | (data[i + 1] << 16) | (data[i + 2] << 8) | data[i + 3]
+            i += 4
+        id_length = 0
+        if header & _FLAG_IL:
+            id_length = data[i]
+            i += 1
+        end = i + type_length + id_length + payload_length
+        if end > len(data):
+            raise ValueError('truncated NDEF record')
+        record_type = data[i:i + type_length]
+        record_id = data[i + type_length:i + type_length + id_length]
+        payload = data[i + type_length + id_length:end]
+        i = end
+        tnf = header & 0x07
+        if chunk is not None: # middle or last chunk
+            if tnf != TNF_UNCHANGED:
+                raise ValueError('bad NDEF chunk')
+            chunk.payload += payload
+            if not header & _FLAG_CF:
+                records.append(chunk)
+                chunk = None
+        elif header & _FLAG_CF:
+            chunk = Record(tnf, record_type, payload, record_id)
+        else:
+            records.append(Record(tnf, record_type, payload, record_id))
+        if header & _FLAG_ME:
+            break
+    if chunk is not None:
+        raise ValueError('truncated NDEF chunk')
+    return records
+
+# Wrap an NDEF message in an NDEF TLV followed by a terminator TLV, ready to write from NTAG page 4
+def wrapTLV(message):
+    length = len(message)
+    if length < 0xFF:
+        header = bytes([_TLV_NDEF, length])
+    else:
+        header = bytes([_TLV_NDEF, 0xFF, length >> 8 & 0xFF, length & 0xFF])
+    return header + bytes(message) + bytes([_TLV_TERMINATOR])
+
+# Find the NDEF TLV in tag memory. Returns (offset, length) of the message, or None if there isn't one.
+# offset + length may run past the end of data when only the start of the memory has been read
+def findTLV(data):
+    i = 0
+    while i < len(data):
+        tag = data[i]
+        if tag == _TLV_NULL:
+            i += 1
+            continue
+        if tag == _TLV_TERMINATOR or i + 1 >= len(data):
+            return None
+        length = data[i + 1]
+        i += 2
+        if length == 0xFF:
+            if i + 2 > len(data):
+                return None
+            length = (data[i] << 8) | data[i + 1]
+            i += 2
+        if tag == _TLV_NDEF:
+            return (i, length)
+        i += length # lock control, memory control and proprietary TLVs
+    return None
+
+# The NDEF message held in tag memory, or None
+def unwrapTLV(data):
+    found = findTLV(data)
+    if found is None or found[0] + found[1] > len(data):
+        return None
+    return bytes(data[found[0]:found[0] + found[1]])
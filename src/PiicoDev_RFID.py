@@ -53,14 +53,33 @@ _TAG_CMD_ANTCOL3 = 0x97
 _TAG_AUTH_KEY_A = 0x60
 _CLASSIC_KEY = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
 
+_TIMEOUT_MS = 100 # Longest wait for the module to finish a command. Its own timer gives up on a silent tag after 25ms
+
+if _SYSNAME == 'Linux':
+    # Adapts a Raspberry Pi GPIO (BCM numbering) wired to the module's IRQ pin for use as irq_pin. Requires gpiozero
+    # Any object with value() and, optionally, irq(handler, trigger) like machine.Pin can be used instead
+    class LinuxIRQPin(object):
+        IRQ_RISING = 1
+
+        def __init__(self, gpio):
+            from gpiozero import DigitalInputDevice
+            self._device = DigitalInputDevice(gpio, pull_up=None, active_state=True)
+
+        def value(self):
+            return self._device.value
+
+        def irq(self, handler=None, trigger=IRQ_RISING):
+            self._device.when_activated = None if handler is None else (lambda: handler(self))
+
 class PiicoDev_RFID(object):
     OK = 1
     NOTAGERR = 2
     ERR = 3
+    COLLISION = 4
 
-    def __init__(self, bus=None, freq=None, sda=None, scl=None, address=_I2C_ADDRESS, asw=None, suppress_warnings=False):
+    def __init__(self, bus=None, freq=None, sda=None, scl=None, address=_I2C_ADDRESS, asw=None, irq_pin=None, timeout_ms=_TIMEOUT_MS, host_crc=True, suppress_warnings=False):
         try:
-            if compat_ind >= 1:
+            if compat_ind >= 2:
                 pass
             else:
                 print(compat_str)
@@ -76,6 +95,19 @@ class PiicoDev_RFID(object):
             
         self._tag_present = False
         self._read_tag_id_success = False
+        self._presence = False
+        self._active_tag = None # readTagID() result while that tag is still selected
+        self._page_cache = None # (tag, first page, bytes) read from or written to the selected NTAG during the current operation
+        self._read_only_uid = None # formatted ID of the last tag that rejected FAST_READ
+        self.classic_key = list(_CLASSIC_KEY) # MIFARE Classic key A used for authentication
+        self.timeout_ms = timeout_ms
+        self._irq_pin = irq_pin # optional pin wired to IRQ. Commands then wait on the pin instead of polling registers
+        self._irq_flag = False
+        self._com_i_en = 0x20
+        self.burst_fifo = True # move FIFO contents in one I2C transaction rather than one per byte
+        self.host_crc = host_crc and hasattr(self, '_crcHost') # host CRC needs PiicoDev_RFID_Expansion
+        if irq_pin is not None and hasattr(irq_pin, 'irq'):
+            irq_pin.irq(handler=self._irqHandler, trigger=getattr(irq_pin, 'IRQ_RISING', 1))
         self.reset()
         sleep_ms(50)
         self._wreg(_REG_T_MODE, 0x80)
@@ -98,6 +130,12 @@ class PiicoDev_RFID(object):
     def _wfifo(self, reg, val):
         self.i2c.writeto_mem(self.address, reg, bytes(val))
 
+    # I2C read of n bytes from the FIFO buffer. The register address does not advance, so a burst drains the FIFO
+    def _rfifo(self, n):
+        if self.burst_fifo:
+            return bytes(self.i2c.readfrom_mem(self.address, _REG_FIFO_DATA, n))
+        return bytes([self._rreg(_REG_FIFO_DATA) for _ in range(n)])
+
     # I2C read from register
     def _rreg(self, reg):
         val = self.i2c.readfrom_mem(self.address, reg, 1)
@@ -112,9 +150,24 @@ class PiicoDev_RFID(object):
     def _cflags(self, reg, mask):
         self._wreg(reg, self._rreg(reg) & (~mask))
 
-    # Communicates with the tag
-    def _tocard(self, cmd, send):
-        recv = []
+    def _irqHandler(self, pin):
+        self._irq_flag = True
+
+    # Wait until any of the mask bits are set in an interrupt request register. Returns the register value, or None after timeout_ms
+    # With an IRQ pin the register is only read once the pin signals, rather than continuously
+    def _waitIrq(self, reg, mask):
+        start = ticks_ms()
+        while True:
+            if self._irq_pin is None or self._irq_flag or self._irq_pin.value():
+                n = self._rreg(reg)
+                if n & mask:
+                    return n
+            if ticks_diff(ticks_ms(), start) > self.timeout_ms:
+                return None
+
+    # Communicates with the tag. allow_collision=True returns COLLISION and the bits received up to a collision instead of ERR
+    def _tocard(self, cmd, send, allow_collision=False):
+        recv = b''
         bits = irq_en = wait_irq = n = 0
         stat = self.ERR
 
@@ -125,7 +178,11 @@ class PiicoDev_RFID(object):
             irq_en = 0x77
             wait_irq = 0x30
         self._wreg(_REG_COMMAND, _CMD_IDLE)      # Stop any active command.
+        if self._irq_pin is not None and self._com_i_en != wait_irq | 0x01:
+            self._com_i_en = wait_irq | 0x01
+            self._wreg(_REG_COM_I_EN, self._com_i_en) # Only completion and timer interrupts drive the IRQ pin
         self._wreg(_REG_COM_IRQ, 0x7F)           # Clear all seven interrupt request bits
+        self._irq_flag = False
         self._sflags(_REG_FIFO_LEVEL, 0x80)      # FlushBuffer = 1, FIFO initialization
         self._wfifo(_REG_FIFO_DATA, send)        # Write to the FIFO
         if cmd == _CMD_TRANCEIVE:
@@ -134,21 +191,13 @@ class PiicoDev_RFID(object):
         if cmd == _CMD_TRANCEIVE:
             self._sflags(_REG_BIT_FRAMING, 0x80) # This starts the transceive operation
 
-        i = 20000  #2000
-        while True:
-            n = self._rreg(_REG_COM_IRQ)
-            i -= 1
-            if n & wait_irq:
-                break
-            if n & 0x01:
-                break
-            if i == 0:
-                break
+        n = self._waitIrq(_REG_COM_IRQ, wait_irq | 0x01)
         self._cflags(_REG_BIT_FRAMING, 0x80)
         
-        if i:
-            if (self._rreg(_REG_ERROR) & 0x1B) == 0x00:
-                stat = self.OK
+        if n is not None:
+            error = self._rreg(_REG_ERROR) & 0x1B
+            if error == 0x00 or (allow_collision and error == 0x08):
+                stat = self.OK if error == 0x00 else self.COLLISION
 
                 if n & irq_en & 0x01:
                     stat = self.NOTAGERR
@@ -161,31 +210,38 @@ class PiicoDev_RFID(object):
                         bits = n * 8
                     if n == 0:
                         n = 1
-                    elif n > 16:
-                        n = 16
+                    elif n > 64: # FIFO size
+                        n = 64
 
-                    for _ in range(n):
-                        recv.append(self._rreg(_REG_FIFO_DATA))
+                    recv = self._rfifo(n)
             else:
                 stat = self.ERR
         return stat, recv, bits
 
-    # Use the co-processor on the RFID module to obtain CRC
+    # CRC_A of a frame as [LSB, MSB]
     def _crc(self, data):
+        if self.host_crc:
+            return self._crcHost(data)
+        return self._crcChip(data)
+
+    # Use the co-processor on the RFID module to obtain CRC
+    def _crcChip(self, data):
         self._wreg(_REG_COMMAND, _CMD_IDLE)
         self._cflags(_REG_DIV_IRQ, 0x04)
         self._sflags(_REG_FIFO_LEVEL, 0x80)
 
-        for c in data:
-            self._wreg(_REG_FIFO_DATA, c)
+        if self.burst_fifo:
+            self._wfifo(_REG_FIFO_DATA, data)
+        else:
+            for c in data:
+                self._wreg(_REG_FIFO_DATA, c)
+        if self._irq_pin is not None:
+            self._wreg(_REG_DIV_I_EN, 0x84) # CRCIRq drives the IRQ pin while the co-processor is busy
+            self._irq_flag = False
         self._wreg(_REG_COMMAND, _CMD_CALC_CRC)
-
-        i = 0xFF
-        while True:
-            n = self._rreg(_REG_DIV_IRQ)
-            i -= 1
-            if not ((i != 0) and not (n & 0x04)):
-                break
+        self._waitIrq(_REG_DIV_IRQ, 0x04)
+        if self._irq_pin is not None:
+            self._wreg(_REG_DIV_I_EN, 0x80)
         self._wreg(_REG_COMMAND, _CMD_IDLE)
         return [self._rreg(_REG_CRC_RESULT_LSB), self._rreg(_REG_CRC_RESULT_MSB)]
     
@@ -281,6 +337,7 @@ class PiicoDev_RFID(object):
     
     # Resets the RFID module
     def reset(self):
+        self._active_tag = None
         self._wreg(_REG_COMMAND, _CMD_SOFT_RESET)
 
     # Turns the antenna on
@@ -290,6 +347,7 @@ class PiicoDev_RFID(object):
     
     # Turns the antenna off
     def antennaOff(self):
+        self._active_tag = None
         if not (~(self._rreg(_REG_TX_CONTROL) & 0x03)):
             self._cflags(_REG_TX_CONTROL, b'\x03')
 
@@ -303,8 +361,10 @@ class PiicoDev_RFID(object):
             read_tag_id_result = self._readTagID()
             if read_tag_id_result['success']:
                 self._read_tag_id_success = True
-                return {'success':read_tag_id_result['success'], 'id_integers':read_tag_id_result['id_integers'], 'id_formatted':read_tag_id_result['id_formatted'], 'type':read_tag_id_result['type']}
+                self._active_tag = {'success':read_tag_id_result['success'], 'id_integers':read_tag_id_result['id_integers'], 'id_formatted':read_tag_id_result['id_formatted'], 'type':read_tag_id_result['type']}
+                return dict(self._active_tag)
         self._read_tag_id_success = False
+        self._active_tag = None
         return {'success':False, 'id_integers':[0], 'id_formatted':'', 'type':''}
 
     # Wrapper for readTagID
@@ -322,6 +382,6 @@ class PiicoDev_RFID(object):
     # Use PiicoDev_RFID_Expansion if not Micro:bit
     if _SYSNAME != 'microbit':
         try:
-            from PiicoDev_RFID_Expansion import _classicSelectTag, _classicAuth, _classicStopCrypto, _writePageNtag, _classicWrite, _writeClassicRegister, _read, _readClassicData, _writeNumberToNtag, _writeNumberToClassic, writeNumber, readNumber, _writeTextToNtag, _writeTextToClassic, writeText, _readTextFromNtag, _readTextFromClassic, readText, writeURI
+            from PiicoDev_RFID_Expansion import _activeTag, _forgetTag, _withTag, tagTracker, _anticollLevel, _selectLevel, _halt, inventory, classicSession, _crcHost, crcSelfTest, benchmarkBlockRead, _setTimerReload, _requestFast, tagPresentFast, pollPresence, _classicSelectTag, _classicAuth, _classicStopCrypto, _writePageNtag, _classicWrite, _writeClassicRegister, _read, _fastRead, _fastReadRejected, readPages, _readClassicData, _writeNumberToNtag, _writeNumberToClassic, writeNumber, readNumber, _writeTextToNtag, _writeTextToClassic, writeText, _readTextFromNtag, _readTextFromClassic, readText, _readNtagPages, _cachePage, _writeNtagImage, _readNdefFromNtag, readNDEF, writeNDEF, writeURI, _writeClassicImage
         except:
             print('Install PiicoDev_RFID_Expansion.py for full functionality')
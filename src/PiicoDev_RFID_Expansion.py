@@ -10,20 +10,36 @@
 
 from PiicoDev_Unified import *
 import struct
-from time import time as now
 
-_REG_STATUS_2   = 0x08
+_REG_STATUS_2    = 0x08
+_REG_BIT_FRAMING = 0x0D
+_REG_COLL        = 0x0E
+_REG_T_RELOAD_HI = 0x2C
+_REG_T_RELOAD_LO = 0x2D
 _CMD_TRANCEIVE  = 0x0C
 _CMD_MF_AUTHENT = 0x0E
 
 
+# Timer reload values, in ticks of 25us (prescaler 0xA9 set by PiicoDev_RFID)
+_TIMER_RELOAD_DEFAULT  = 0x03E8 # 25ms, enough for any tag command
+_TIMER_RELOAD_PRESENCE = 0x0050 # 2ms. A tag answers REQA/WUPA within ~0.3ms
+
 # RFID Tag (Proximity Integrated Circuit Card)
 _TAG_CMD_REQIDL  = 0x26
+_TAG_CMD_REQALL  = 0x52
+_TAG_CMD_HALT    = 0x50
+_TAG_CMD_CASCADE = (0x93, 0x95, 0x97) # SEL for cascade levels 1-3
+_TAG_SAK_UID_INCOMPLETE = 0x04
 
 # NTAG
 _NTAG_NO_BYTES_PER_PAGE = 4
 _NTAG_PAGE_ADR_MIN = 4 # user memory is 4 to 39 for NTAG213 so that allows for 144 characters.  So that's 36 pages
 _NTAG_PAGE_ADR_MAX = 39
+_NTAG_CMD_READ = 0x30
+_NTAG_CMD_FAST_READ = 0x3A
+_NTAG_FAST_READ_MAX_PAGES = 15 # 15 pages and CRC fill the 64 byte FIFO
+_NTAG_PAGE_CC = 3 # capability container, its third byte is the data area size / 8
+_NTAG_CC_MAGIC = 0xE1
 
 # Classic
 _TAG_AUTH_KEY_A = 0x60
@@ -35,21 +51,382 @@ _CLASSIC_ADR = [1, 2, 4, 5, 6, 8, 9, 10, 12, 13, 14, 16, 17, 18, 20, 21, 22, 24,
 _SLOT_NO_MIN = 0
 _SLOT_NO_MAX = 35
 
+_OP_TIMEOUT_MS = 1000 # Longest a data operation keeps re-detecting and retrying once a tag has been found
+_DETECT_POLL_MS = 10 # Pause between detection attempts while waiting for a tag
+
+# CRC_A (ISO/IEC 14443-3) is CRC-16/CCITT, bit-reversed (polynomial 0x8408), preset 0x6363
+def _crcATable():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+_CRC_A_TABLE = _crcATable()
+_CRC_A_PRESET = 0x6363
+
+# ----------------------------- CRC ---------------------------------------------------
+
+# Calculate CRC_A on the host. Saves the FIFO writes, co-processor command and result reads of _crcChip
+def _crcHost(self, data):
+    crc = _CRC_A_PRESET
+    for c in data:
+        crc = (crc >> 8) ^ _CRC_A_TABLE[(crc ^ c) & 0xFF]
+    return [crc & 0xFF, crc >> 8]
+
+# Check the host CRC against the module's co-processor. Returns True when they agree on every frame
+def crcSelfTest(self, frames=None):
+    if frames is None:
+        frames = [[0x00, 0x00], [0x12, 0x34], [0x30, 0x04], [0x93, 0x70, 0x88, 0x04, 0x11, 0x22, 0xBF], [0x50, 0x00], list(range(16)), [0xFF] * 18]
+    for frame in frames:
+        if self._crcHost(frame) != self._crcChip(frame):
+            return False
+    return True
+
 # Required for Classic Tag only - Select a specific tag for reading & writing
 def _classicSelectTag(self, ser):
-    buf = [0x93, 0x70] + ser[:5]
+    buf = [0x93, 0x70] + list(ser[:5])
     buf += self._crc(buf)
     (stat, recv, bits) = self._tocard(_CMD_TRANCEIVE, buf)
     return self.OK if (stat == self.OK) and (bits == 0x18) else self.ERR
 
 # Required for Classic Tag only - Authenticate the address in memory
 def _classicAuth(self, mode, addr, sect, ser):
-    return self._tocard(_CMD_MF_AUTHENT, [mode, addr] + sect + ser[:4])[0]
+    return self._tocard(_CMD_MF_AUTHENT, [mode, addr] + list(sect) + list(ser[:4]))[0]
 
 # Required for Classic Tag only - Turn off crypto
 def _classicStopCrypto(self):
     self._cflags(_REG_STATUS_2, 0x08)
 
+# Sector holding a Classic block (1K and 4K layouts)
+def _classicSector(block):
+    return block // 4 if block < 128 else 32 + (block - 128) // 16
+
+# An authenticated conversation with one MIFARE Classic tag. The tag is selected once and each
+# sector is authenticated only when a block in it is first used. Close it (or use it as a
+# context manager) to turn crypto off again.
+class ClassicSession(object):
+    def __init__(self, rfid, key=None, key_type=_TAG_AUTH_KEY_A):
+        self.rfid = rfid
+        self.key = list(rfid.classic_key if key is None else key)
+        self.key_type = key_type
+        self.uid = None
+        self._sector = None
+
+    # Select the tag in the field, reusing the selection left by readTagID() if there is one. Returns True on success
+    def open(self):
+        rfid = self.rfid
+        self.uid = None
+        self._sector = None
+        tag = rfid._active_tag
+        rfid._forgetTag() # authentication takes the tag out of the plain selected state
+        if tag is not None and tag['type'] == 'classic':
+            self.uid = bytes(tag['id_integers'])
+            return True
+        (stat, _) = rfid._request(_TAG_CMD_REQIDL)
+        if stat != rfid.OK: # Try again, the card may not be in the correct state
+            (stat, _) = rfid._request(_TAG_CMD_REQIDL)
+        if stat != rfid.OK:
+            return False
+        (stat, raw_uid) = rfid._anticoll()
+        if stat != rfid.OK or rfid._classicSelectTag(raw_uid) != rfid.OK:
+            return False
+        self.uid = raw_uid
+        return True
+
+    def _authenticate(self, block):
+        sector = _classicSector(block)
+        if sector != self._sector:
+            if self.uid is None or self.rfid._classicAuth(self.key_type, block, self.key, self.uid) != self.rfid.OK:
+                self._sector = None
+                return False
+            self._sector = sector
+        return True
+
+    # Read a 16 byte block. Returns bytes, or None on failure
+    def read(self, block):
+        if not self._authenticate(block):
+            return None
+        return self.rfid._read(block)
+
+    # Write a 16 byte block. Returns True on success
+    def write(self, block, data):
+        if not self._authenticate(block):
+            return False
+        return self.rfid._classicWrite(block, data) == self.rfid.OK
+
+    def close(self):
+        self.rfid._classicStopCrypto()
+        self._sector = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+# Open an authenticated session with the Classic tag in the field. Returns a ClassicSession, or None if no tag could be selected
+def classicSession(self, key=None, key_type=_TAG_AUTH_KEY_A):
+    session = ClassicSession(self, key, key_type)
+    return session if session.open() else None
+
+# ----------------------------- Benchmark ---------------------------------------------
+
+# Counts I2C transactions passing through to the bus
+class _TransactionCounter(object):
+    def __init__(self, i2c):
+        self.i2c = i2c
+        self.count = 0
+
+    def writeto_mem(self, *args, **kwargs):
+        self.count += 1
+        return self.i2c.writeto_mem(*args, **kwargs)
+
+    def readfrom_mem(self, *args, **kwargs):
+        self.count += 1
+        return self.i2c.readfrom_mem(*args, **kwargs)
+
+# Reads one 16-byte block (NTAG page address or authenticated Classic block) and counts the I2C transactions it takes
+# with the original byte-wise FIFO access and co-processor CRC, with host CRC, and with host CRC plus burst FIFO access
+def benchmarkBlockRead(self, addr=_NTAG_PAGE_ADR_MIN):
+    settings = (self.host_crc, self.burst_fifo)
+    counter = _TransactionCounter(self.i2c)
+    self.i2c = counter
+    result = {}
+    try:
+        for name, host_crc, burst_fifo in (('original', False, False), ('host_crc', True, False), ('host_crc_burst_fifo', True, True)):
+            self.host_crc = host_crc and hasattr(self, '_crcHost')
+            self.burst_fifo = burst_fifo
+            counter.count = 0
+            data = self._read(addr)
+            result[name] = counter.count if data is not None else None
+    finally:
+        self.i2c = counter.i2c
+        self.host_crc, self.burst_fifo = settings
+    return result
+
+# ----------------------------- Inventory ---------------------------------------------
+
+# Bit-oriented anticollision for one cascade level (ISO/IEC 14443-3). Where tags collide, the
+# branch with a 1 at the collision is followed. Returns the 5 bytes (UID CLn + BCC), or None
+def _anticollLevel(self, sel):
+    known = bytearray(5)
+    count = 0 # number of valid bits in known
+    while count < 40:
+        byte_count = count // 8
+        bit_count = count % 8
+        frame = bytes([sel, ((2 + byte_count) << 4) | bit_count]) + known[:byte_count + (1 if bit_count else 0)]
+        self._wreg(_REG_BIT_FRAMING, (bit_count << 4) | bit_count) # RxAlign and TxLastBits for a split byte
+        self._wreg(_REG_COLL, 0x00) # ValuesAfterColl = 0, bits received after a collision are cleared
+        (stat, recv, bits) = self._tocard(_CMD_TRANCEIVE, frame, allow_collision=True)
+        self._wreg(_REG_BIT_FRAMING, 0x00)
+        if (stat != self.OK and stat != self.COLLISION) or len(recv) == 0:
+            return None
+        for i in range(min(len(recv), 5 - byte_count)): # the first received byte completes the split byte
+            if i == 0 and bit_count:
+                mask = (1 << bit_count) - 1
+                known[byte_count] = (known[byte_count] & mask) | (recv[0] & ~mask & 0xFF)
+            else:
+                known[byte_count + i] = recv[i]
+        if stat == self.OK:
+            if known[0] ^ known[1] ^ known[2] ^ known[3] != known[4]:
+                return None
+            return bytes(known)
+        coll = self._rreg(_REG_COLL)
+        if coll & 0x20: # CollPosNotValid
+            return None
+        count += (coll & 0x1F) or 32 # CollPos counts from the first received bit, 0 means the 32nd
+        if count > 40:
+            return None
+        bit = count - 1
+        known[bit // 8] = (known[bit // 8] & ((1 << (bit % 8)) - 1)) | (1 << (bit % 8)) # choose 1 and drop the bits after it
+        for i in range(bit // 8 + 1, 5):
+            known[i] = 0
+    return None
+
+# Select a cascade level. Returns the SAK, or None
+def _selectLevel(self, sel, level):
+    buf = [sel, 0x70] + list(level)
+    buf += self._crc(buf)
+    (stat, recv, bits) = self._tocard(_CMD_TRANCEIVE, buf)
+    if stat != self.OK or bits != 0x18:
+        return None
+    return recv[0]
+
+# Put the selected tag into the HALT state. It then ignores REQA until it leaves the field or is woken by WUPA
+def _halt(self):
+    self._forgetTag()
+    buf = [_TAG_CMD_HALT, 0x00]
+    buf += self._crc(buf)
+    self._tocard(_CMD_TRANCEIVE, buf)
+
+# List every tag in the field. Each tag is selected in turn and halted, so the next REQA only wakes tags not yet listed.
+# Returns a list of readTagID()-style results with the SAK added. Listed tags are left halted; tagPresentFast() wakes them
+def inventory(self, max_tags=16, max_attempts=3):
+    tags = []
+    uids = []
+    failures = 0
+    request = _TAG_CMD_REQALL # the first request also wakes tags halted by a previous inventory
+    while len(tags) < max_tags and failures < max_attempts:
+        self._wreg(_REG_BIT_FRAMING, 0x07)
+        (stat, recv, bits) = self._tocard(_CMD_TRANCEIVE, [request], allow_collision=True)
+        if stat != self.OK and stat != self.COLLISION:
+            failures += 1 # A tag left active by an earlier read ignores the first request
+            continue
+        request = _TAG_CMD_REQIDL
+        uid = []
+        sak = None
+        for sel in _TAG_CMD_CASCADE:
+            level = self._anticollLevel(sel)
+            sak = None if level is None else self._selectLevel(sel, level)
+            if sak is None:
+                break
+            if sak & _TAG_SAK_UID_INCOMPLETE:
+                uid.extend(level[1:4]) # level starts with the cascade tag
+            else:
+                uid.extend(level[0:4])
+                break
+        if sak is None or sak & _TAG_SAK_UID_INCOMPLETE:
+            failures += 1
+            continue
+        self._halt()
+        failures = 0
+        if uid in uids:
+            continue
+        uids.append(uid)
+        tags.append({'success':True, 'id_integers':uid, 'id_formatted':':'.join('{:02X}'.format(x) for x in uid), 'type':'classic' if len(uid) == 4 else 'ntag', 'sak':sak})
+    self._presence = False
+    self._read_tag_id_success = False
+    self._forgetTag()
+    return tags
+
+# ----------------------------- Presence ----------------------------------------------
+
+# Sets how long the MFRC522 waits for a tag to answer before giving up
+def _setTimerReload(self, reload):
+    self._wreg(_REG_T_RELOAD_HI, reload >> 8)
+    self._wreg(_REG_T_RELOAD_LO, reload & 0xFF)
+
+# REQA (or WUPA, which also wakes halted tags) with a short timeout. Returns True if any tag answered
+def _requestFast(self, wake=True):
+    self._setTimerReload(_TIMER_RELOAD_PRESENCE)
+    (stat, bits) = self._request(_TAG_CMD_REQALL if wake else _TAG_CMD_REQIDL)
+    if stat != self.OK and (self._presence or self._read_tag_id_success): # A tag left active by the last read ignores the first request
+        (stat, bits) = self._request(_TAG_CMD_REQALL if wake else _TAG_CMD_REQIDL)
+    self._forgetTag() # any tag in the field is no longer selected
+    self._setTimerReload(_TIMER_RELOAD_DEFAULT)
+    return stat == self.OK
+
+# Presence check without reading the UID. Much cheaper than tagPresent() when polling
+def tagPresentFast(self, wake=True):
+    self._presence = self._requestFast(wake)
+    return self._presence
+
+# Polls for presence and only reads the UID when a tag arrives.
+# Returns {'present':bool, 'changed':bool, 'id':readTagID() result when a tag has just arrived, otherwise None}
+def pollPresence(self, wake=True):
+    was_present = self._presence
+    present = self.tagPresentFast(wake)
+    tag_id = None
+    if present and not was_present:
+        tag_id = self.readTagID()
+    return {'present':present, 'changed':present != was_present, 'id':tag_id}
+
+# ----------------------------- Active Tag --------------------------------------------
+
+# The tag selected by the last readTagID(), so data operations can skip detection and anticollision. Otherwise reads the tag ID
+def _activeTag(self):
+    if self._active_tag is not None:
+        return dict(self._active_tag)
+    return self.readTagID()
+
+# Drop the cached selection. Called after any command that may have moved the tag out of the selected state
+def _forgetTag(self):
+    self._active_tag = None
+    self._page_cache = None
+
+# Run operation(tag) on the active tag, detecting a tag every _DETECT_POLL_MS until one answers. timeout [s] is how long to wait:
+# None tries once, 0 waits for a tag indefinitely. Whenever the operation fails (returns None) the selection is dropped and the tag
+# detected again, so a stale selection waits just like no selection. Once an operation has been tried, retries go on for at least
+# _OP_TIMEOUT_MS. Returns the operation's result, or None. The read-back cache is dropped first: it only holds pages read during this operation
+def _withTag(self, operation, timeout=None):
+    self._page_cache = None
+    start = ticks_ms()
+    wait_ms = None if timeout == 0 else int((timeout or 0) * 1000)
+    while True:
+        tag = self._activeTag()
+        if tag['success']:
+            result = operation(tag)
+            if result is not None:
+                return result
+            self._forgetTag()
+            if wait_ms is not None:
+                wait_ms = max(wait_ms, _OP_TIMEOUT_MS)
+        if wait_ms is not None and ticks_diff(ticks_ms(), start) >= wait_ms:
+            return None
+        sleep_ms(_DETECT_POLL_MS)
+
+# ----------------------------- Tag Events --------------------------------------------
+
+# Turns presence polling into debounced 'tag_arrived' and 'tag_left' events. The UID is read once when a tag
+# arrives, and a tag only counts as gone after it has been missing for holdoff_ms, so a tag at the edge of
+# the field doesn't flicker. on_arrived and on_left are called with the tag's readTagID() result
+class TagTracker(object):
+    ARRIVED = 'tag_arrived'
+    LEFT = 'tag_left'
+
+    def __init__(self, rfid, holdoff_ms=300, on_arrived=None, on_left=None):
+        self.rfid = rfid
+        self.holdoff_ms = holdoff_ms
+        self.on_arrived = on_arrived
+        self.on_left = on_left
+        self.tag = None # readTagID() result for the tag in the field, or None
+        self._last_seen = None
+        self._missed = False # the tag has not answered every poll since it was last seen
+
+    # Poll once. Returns 'tag_arrived', 'tag_left' or None. A tag swapped for another within the hold-off
+    # calls on_left for the old tag and returns 'tag_arrived' for the new one
+    def update(self):
+        present = self.rfid.tagPresentFast()
+        now_ms = ticks_ms()
+        if present:
+            if self.tag is not None and not self._missed:
+                self._last_seen = now_ms
+                return None
+            tag = self.rfid.readTagID() # a new tag, or the tracked tag back after a gap
+            if tag['success'] is False:
+                return None
+            self._last_seen = now_ms
+            self._missed = False
+            if self.tag is not None and tag['id_integers'] == self.tag['id_integers']:
+                return None
+            if self.tag is not None:
+                self._leave()
+            self.tag = tag
+            if self.on_arrived is not None:
+                self.on_arrived(tag)
+            return self.ARRIVED
+        if self.tag is None:
+            return None
+        self._missed = True
+        if ticks_diff(now_ms, self._last_seen) < self.holdoff_ms:
+            return None
+        self._leave()
+        return self.LEFT
+
+    def _leave(self):
+        tag = self.tag
+        self.tag = None
+        self._missed = False
+        if self.on_left is not None:
+            self.on_left(tag)
+
+# Create a TagTracker for this module
+def tagTracker(self, holdoff_ms=300, on_arrived=None, on_left=None):
+    return TagTracker(self, holdoff_ms, on_arrived, on_left)
+
 # ----------------------------- Write -------------------------------------------------
 
 # Write to an NTAG page
@@ -79,117 +456,220 @@ def _classicWrite(self, addr, data):
 
 # Prepare a Classic to write to a register
 def _writeClassicRegister(self, register, data_byte_array):
-    while True:
-        auth_result = 0
-        (stat, tag_type) = self._request(_TAG_CMD_REQIDL)
-
-        if stat == self.OK:
-            (stat, raw_uid) = self._anticoll()
-
-            if stat == self.OK:
-                if self._classicSelectTag(raw_uid) == self.OK:
-                    auth_result = self._classicAuth(_TAG_AUTH_KEY_A, register, _CLASSIC_KEY, raw_uid)
-                    if (auth_result == self.OK):
-                        stat = self._classicWrite(register, data_byte_array)
-                        self._classicStopCrypto()
-                        if stat == self.OK:
-                            return True
-                        else:
-                            print("Failed to write data to tag")
-                            return False
-                    else:
-                        print("Authentication error")
-                        return False
-                else:
-                    print("Failed to select tag")
-                    return False   
+    session = ClassicSession(self)
+    if not session.open():
+        return False
+    with session:
+        if not session._authenticate(register):
+            print("Authentication error")
+            return False
+        if session.write(register, data_byte_array):
+            return True
+        print("Failed to write data to tag")
+        return False
 
 # ------------------------------ Read ----------------------------------------------------
 
-# Read a register from NTAG or Classic
+# Read a register from NTAG or Classic. NTAG returns four pages (16 bytes) from addr
 def _read(self, addr):
-    data = [0x30, addr]
+    data = [_NTAG_CMD_READ, addr]
     data += self._crc(data)
     (stat, recv, _) = self._tocard(_CMD_TRANCEIVE, data)
-    return recv if stat == self.OK else None
-
-# Prepare a classic to read a register
+    if stat != self.OK or len(recv) < 16:
+        return None
+    if self.host_crc and len(recv) == 18 and self._crc(recv[:16]) != list(recv[16:]):
+        return None
+    return recv[:16]
+
+# Read NTAG pages start to end (inclusive) with one FAST_READ
+def _fastRead(self, start, end):
+    data = [_NTAG_CMD_FAST_READ, start, end]
+    data += self._crc(data)
+    (stat, recv, _) = self._tocard(_CMD_TRANCEIVE, data)
+    length = (end - start + 1) * _NTAG_NO_BYTES_PER_PAGE
+    if stat != self.OK or len(recv) != length + 2:
+        return None
+    if self.host_crc and self._crc(recv[:length]) != list(recv[length:]):
+        return None
+    return recv[:length]
+
+# FAST_READ is NTAG21x only. MIFARE Ultralight and NTAG203 NAK it, which also drops them out of the selected state.
+# Select the tag again and check that READ works. If it does, READ is used for this tag from now on
+def _fastReadRejected(self, page):
+    tag = self.readTagID()
+    if not tag['success'] or self._read(page) is None:
+        return False
+    self._read_only_uid = tag['id_formatted']
+    return True
+
+# Read NTAG pages start to end (inclusive). Returns bytes, or None if the tag did not answer.
+# fast=True uses FAST_READ (NTAG21x), up to 15 pages per command, and falls back to READ for tags without it.
+# fast=False uses READ, four pages per command
+def readPages(self, start, end, fast=True):
+    tag = self._active_tag
+    if tag is not None and tag['id_formatted'] == self._read_only_uid:
+        fast = False
+    data = bytearray()
+    page = start
+    while page <= end:
+        if fast:
+            last = min(end, page + _NTAG_FAST_READ_MAX_PAGES - 1)
+            chunk = self._fastRead(page, last)
+            if chunk is None and self._fastReadRejected(page):
+                fast = False
+                continue
+        else:
+            last = min(end, page + 3)
+            chunk = self._read(page)
+            if chunk is not None:
+                chunk = chunk[:(last - page + 1) * _NTAG_NO_BYTES_PER_PAGE]
+        if chunk is None:
+            return None
+        data.extend(chunk)
+        page = last + 1
+    return bytes(data)
+
+# Prepare a classic to read a register. Returns None on failure
 def _readClassicData(self, register):
-    tag_data = None
-    auth_result = 0
-    while tag_data is None:
-        (stat, tag_type) = self._request(_TAG_CMD_REQIDL)
-        if stat == self.OK:
-            (stat, raw_uid) = self._anticoll()
-            if stat == self.OK:
-                if self._classicSelectTag(raw_uid) == self.OK:
-                    auth_result = self._classicAuth(_TAG_AUTH_KEY_A, register, _CLASSIC_KEY, raw_uid)
-                    if (auth_result == self.OK):
-                        tag_data = self._read(register)
-                        self._classicStopCrypto()
-                        return tag_data
-                    else:
-                        print("Authentication error")
-                else:
-                    print("Failed to select tag")
-        sleep_ms(10)
+    session = ClassicSession(self)
+    if not session.open():
+        return None
+    with session:
+        if session._authenticate(register):
+            return session.read(register)
+        print("Authentication error")
+    return None
+
+# ----------------------------- Differential Write ---------------------------------------
+
+# Read NTAG pages start to end (inclusive) in bulk. With cached=True they come from the read-back cache where it holds
+# them, and only the pages past its end are read. The cache only lives for one operation (see _withTag) while the tag stays selected
+def _readNtagPages(self, start, end, cached=False):
+    cache = self._page_cache
+    if cached and cache is not None and cache[0] is self._active_tag and cache[1] <= start:
+        cache_end = cache[1] + len(cache[2]) // _NTAG_NO_BYTES_PER_PAGE - 1
+        if cache_end + 1 >= start and end > cache_end:
+            rest = self.readPages(cache_end + 1, end)
+            if rest is None:
+                return None
+            cache[2].extend(rest)
+            cache_end = end
+        if end <= cache_end:
+            offset = (start - cache[1]) * _NTAG_NO_BYTES_PER_PAGE
+            return bytes(cache[2][offset:offset + (end - start + 1) * _NTAG_NO_BYTES_PER_PAGE])
+    data = self.readPages(start, end)
+    if data is not None and self._active_tag is not None:
+        self._page_cache = (self._active_tag, start, bytearray(data))
+    return data
+
+# Keep the read-back cache in step with a page just written
+def _cachePage(self, page, data):
+    cache = self._page_cache
+    if cache is not None and cache[0] is self._active_tag and cache[1] <= page < cache[1] + len(cache[2]) // _NTAG_NO_BYTES_PER_PAGE:
+        offset = (page - cache[1]) * _NTAG_NO_BYTES_PER_PAGE
+        cache[2][offset:offset + _NTAG_NO_BYTES_PER_PAGE] = data
+
+# Offsets of the units (pages or blocks) of image that differ from current. Everything differs when current is None
+def _diffUnits(current, image, unit):
+    if current is None:
+        return list(range(0, len(image), unit))
+    return [offset for offset in range(0, len(image), unit) if current[offset:offset + unit] != image[offset:offset + unit]]
+
+# Write an image to consecutive NTAG pages from start_page, padded to whole pages. The tag's current contents are read in bulk
+# and only the pages that differ are written, each at most retries times. With verify=True the written pages are read back
+# and compared before they count as written. Returns True when the tag holds the image.
+# The current contents always come from the tag, unless cached=True and the caller has just read them in the same operation
+def _writeNtagImage(self, start_page, image, retries=3, verify=True, cached=False):
+    image = bytes(image) + bytes(-len(image) % _NTAG_NO_BYTES_PER_PAGE)
+    current = self._readNtagPages(start_page, start_page + len(image) // _NTAG_NO_BYTES_PER_PAGE - 1, cached=cached)
+    pending = _diffUnits(current, image, _NTAG_NO_BYTES_PER_PAGE)
+    for _ in range(retries):
+        if not pending:
+            return True
+        failed = []
+        for offset in pending:
+            page = start_page + offset // _NTAG_NO_BYTES_PER_PAGE
+            page_data = image[offset:offset + _NTAG_NO_BYTES_PER_PAGE]
+            if self._writePageNtag(page, list(page_data)) != self.OK:
+                failed.append(offset)
+            elif not verify:
+                self._cachePage(page, page_data)
+        if verify:
+            first = pending[0]
+            written = self.readPages(start_page + first // _NTAG_NO_BYTES_PER_PAGE, start_page + pending[-1] // _NTAG_NO_BYTES_PER_PAGE)
+            if written is None:
+                failed = pending
+            else:
+                failed = [offset for offset in pending if written[offset - first:offset - first + _NTAG_NO_BYTES_PER_PAGE] != image[offset:offset + _NTAG_NO_BYTES_PER_PAGE]]
+                for offset in pending:
+                    self._cachePage(start_page + offset // _NTAG_NO_BYTES_PER_PAGE, written[offset - first:offset - first + _NTAG_NO_BYTES_PER_PAGE])
+        pending = failed
+    return not pending
+
+# Write an image to Classic blocks, 16 bytes per block (padded with zeros), in one session. Blocks that already hold their
+# data are skipped, the others are written at most retries times and, with verify=True, read back. Uses session if given,
+# otherwise opens one. Returns True when the tag holds the image
+def _writeClassicImage(self, blocks, image, retries=3, verify=True, session=None):
+    image = bytes(image) + bytes(len(blocks) * _CLASSIC_NO_BYTES_PER_REG - len(image))
+    own_session = session is None
+    if own_session:
+        session = self.classicSession()
+        if session is None:
+            return False
+    try:
+        pending = []
+        for i, block in enumerate(blocks):
+            if session.read(block) != image[i * _CLASSIC_NO_BYTES_PER_REG:(i + 1) * _CLASSIC_NO_BYTES_PER_REG]:
+                pending.append(i)
+        for _ in range(retries):
+            if not pending:
+                return True
+            failed = []
+            for i in pending:
+                block_data = image[i * _CLASSIC_NO_BYTES_PER_REG:(i + 1) * _CLASSIC_NO_BYTES_PER_REG]
+                if not session.write(blocks[i], block_data) or (verify and session.read(blocks[i]) != block_data):
+                    failed.append(i)
+            pending = failed
+        return not pending
+    finally:
+        if own_session:
+            session.close()
 
 # ----------------------------- Write Number --------------------------------------------
 
-# Writes a number to NTAG
+# Writes a number to NTAG. The page is only written if it holds a different number
 def _writeNumberToNtag(self, bytes_number, slot=0):
-    tag_write_success = False
     assert slot >= _SLOT_NO_MIN and slot <=_SLOT_NO_MAX, 'Slot must be between 0 and 35'
-    page_adr_min = 4
-    stat = self._writePageNtag(page_adr_min+slot, bytes_number)
-    tag_write_success = False
-    if stat == self.OK:
-        tag_write_success = True
-    return tag_write_success
-
-# Writes a number to Classic
+    return self._writeNtagImage(_NTAG_PAGE_ADR_MIN+slot, bytes_number)
+
+# Writes a number to Classic. The block is only written if it holds a different number
 def _writeNumberToClassic(self, bytes_number, slot=0):
     assert slot >= _SLOT_NO_MIN and slot <=_SLOT_NO_MAX, 'Slot must be between 0 and 35'
-    while len(bytes_number) < _CLASSIC_NO_BYTES_PER_REG:
-        bytes_number.append(0)
-    tag_write_success = self._writeClassicRegister(_CLASSIC_ADR[slot], bytes_number)
-    return tag_write_success
+    return self._writeClassicImage([_CLASSIC_ADR[slot]], bytes_number)
 
-# Writes a number to the tag
-def writeNumber(self, number, slot=35):
-    success = False
-    bytearray_number = bytearray(struct.pack('l', number))
-    read_tag_id_result = self.readTagID()
-    while read_tag_id_result['success'] is False:
-        read_tag_id_result = self.readTagID()
-    if read_tag_id_result['success']:
-        if read_tag_id_result['type'] == 'ntag':
+# Writes a number to the tag. Waits for a tag when timeout is 0, otherwise for up to timeout seconds
+def writeNumber(self, number, slot=35, timeout=0):
+    bytearray_number = bytearray(struct.pack('<l', number)) # 4 bytes on every platform
+    def write(tag):
+        if tag['type'] == 'ntag':
             success = self._writeNumberToNtag(bytearray_number, slot)
-            while success is False:
-                success = self._writeNumberToNtag(bytearray_number, slot)
-        if read_tag_id_result['type'] == 'classic':
+        else:
             success = self._writeNumberToClassic(bytearray_number, slot)
-            while success is False:
-                success = self._writeNumberToClassic(bytearray_number, slot)
-    return success
+        return True if success else None
+    return self._withTag(write, timeout) is not None
 
 # ----------------------------- Read Number --------------------------------------------
 
-# Reads a number from the tag
-def readNumber(self, slot=35):
-    bytearray_number = None
-    read_tag_id_result = self.readTagID()
-    while read_tag_id_result['success'] is False:
-        read_tag_id_result = self.readTagID()
-    if read_tag_id_result['type'] == 'ntag':
-        page_address = 4
-        bytearray_number = self._read(page_address+slot)
-
-    if read_tag_id_result['type'] == 'classic':
-        bytearray_number = self._readClassicData(_CLASSIC_ADR[slot])
-    
+# Reads a number from the tag. Waits for a tag when timeout is 0, otherwise for up to timeout seconds
+def readNumber(self, slot=35, timeout=0):
+    def read(tag):
+        if tag['type'] == 'ntag':
+            page_address = 4
+            return self._read(page_address+slot)
+        return self._readClassicData(_CLASSIC_ADR[slot])
+    bytearray_number = self._withTag(read, timeout)
     try:
-        number = struct.unpack('l', bytes(bytearray_number[:4]))
+        number = struct.unpack('<l', bytes(bytearray_number[:4]))
         number = number[0]
         return number
     except:
@@ -198,108 +678,155 @@ def readNumber(self, slot=35):
 
 # ----------------------------- Write Text --------------------------------------------
 
-# Writes text to NTAG.
+# The bytes of text to write. Up to and including the first null, or the whole data area with ignore_null=True
+def _textImage(text, size, ignore_null):
+    data = bytes([ord(x) for x in text[:size]])
+    if ignore_null:
+        return data + bytes(size - len(data))
+    end = data.find(b'\0')
+    return data if end < 0 else data[:end + 1]
+
+# Writes text to NTAG. Only pages that change are written
 def _writeTextToNtag(self, text, ignore_null=False): # NTAG213
-    buffer_start = 0
-    for page_adr in range (_NTAG_PAGE_ADR_MIN,_NTAG_PAGE_ADR_MAX+1):
-        data_chunk = text[buffer_start:buffer_start+_NTAG_NO_BYTES_PER_PAGE]
-        buffer_start = buffer_start + _NTAG_NO_BYTES_PER_PAGE
-        data_byte_array = [ord(x) for x in list(data_chunk)]
-        while len(data_byte_array) < _NTAG_NO_BYTES_PER_PAGE:
-            data_byte_array.append(0)
-        tag_write_success = self._writePageNtag(page_adr, data_byte_array)
-        if ignore_null is False:
-            if 0 in data_byte_array: # Null found.  Job complete.
-                return tag_write_success
-    return tag_write_success
-
-# Writes text to Classic.
+    image = _textImage(text, (_NTAG_PAGE_ADR_MAX - _NTAG_PAGE_ADR_MIN + 1) * _NTAG_NO_BYTES_PER_PAGE, ignore_null)
+    return self._writeNtagImage(_NTAG_PAGE_ADR_MIN, image)
+
+# Writes text to Classic. The tag is selected once, each sector authenticated once, and only blocks that change are written
 def _writeTextToClassic(self, text, ignore_null=False):
-    buffer_start = 0
-    x = 0
-    for slot in range(9):
-        data_chunk = text[buffer_start:buffer_start+_CLASSIC_NO_BYTES_PER_REG]
-        buffer_start = buffer_start + _CLASSIC_NO_BYTES_PER_REG
-        data_byte_array = [ord(x) for x in list(data_chunk)]
-        while len(data_byte_array) < _CLASSIC_NO_BYTES_PER_REG:
-            data_byte_array.append(0)
-        tag_write_success = self._writeClassicRegister(_CLASSIC_ADR[slot], data_byte_array)
-        if ignore_null is False:
-            if 0 in data_byte_array: # Null found.  Job complete.
-                return tag_write_success
-    return tag_write_success
+    image = _textImage(text, 9 * _CLASSIC_NO_BYTES_PER_REG, ignore_null)
+    blocks = _CLASSIC_ADR[:(len(image) + _CLASSIC_NO_BYTES_PER_REG - 1) // _CLASSIC_NO_BYTES_PER_REG]
+    return self._writeClassicImage(blocks, image)
 
 # Writes text to the tag.
 def writeText(self, text, ignore_null=False):
     success = False
     maximum_characters = 144
     text = text + '\0'
-    read_tag_id_result = self.readTagID()
-    if read_tag_id_result['type'] == 'ntag':
-        success = self._writeTextToNtag(text, ignore_null=ignore_null)
-    if read_tag_id_result['type'] == 'classic':
-        success = self._writeTextToClassic(text, ignore_null=ignore_null)
-    return success
+    def write(tag):
+        if tag['type'] == 'ntag':
+            success = self._writeTextToNtag(text, ignore_null=ignore_null)
+        else:
+            success = self._writeTextToClassic(text, ignore_null=ignore_null)
+        return True if success else None
+    return self._withTag(write) is not None
 
 # ----------------------------- Read Text --------------------------------------------
 
-# Reads text from NTAG.
+# Reads text from NTAG. Returns None if the tag did not answer at all
 def _readTextFromNtag(self):
-    total_string = ''
-    try:
-        for page_adr in range (_NTAG_PAGE_ADR_MIN,_NTAG_PAGE_ADR_MAX+1):
-            page_data = self._read(page_adr)[:4]
-            page_text = "".join(chr(x) for x in page_data)
-            total_string = total_string + page_text
-            if 0 in page_data: # Null found.  Job complete.
-                substring = total_string.split('\0')
-                return substring[0]
-            page_adr = page_adr + _NTAG_NO_BYTES_PER_PAGE
-    except:
-        pass
-    return total_string
-
-# Reads text from Classic.
+    text = bytearray()
+    page = _NTAG_PAGE_ADR_MIN
+    while page <= _NTAG_PAGE_ADR_MAX:
+        last = min(_NTAG_PAGE_ADR_MAX, page + _NTAG_FAST_READ_MAX_PAGES - 1)
+        chunk = self.readPages(page, last)
+        if chunk is None: # return what has been read so far
+            if page == _NTAG_PAGE_ADR_MIN:
+                return None
+            break
+        end = chunk.find(b'\0')
+        if end >= 0: # Null found.  Job complete.
+            text.extend(chunk[:end])
+            break
+        text.extend(chunk)
+        page = last + 1
+    return ''.join(chr(x) for x in text)
+
+# Reads text from Classic. The tag is selected once and each sector authenticated once. Returns None if nothing could be read
 def _readTextFromClassic(self):
-    x = 0
-    total_string = ''
-    try:
+    text = bytearray()
+    session = self.classicSession()
+    if session is None:
+        return None
+    with session:
         for slot in range(9):
-            reg_data = self._readClassicData(_CLASSIC_ADR[slot])
-            reg_text = "".join(chr(x) for x in reg_data)
-            total_string = total_string + reg_text
-            if 0 in reg_data: # Null found.  Job complete.
-                substring = total_string.split('\0')
-                return substring[0]
-    except: pass
-    return total_string
+            reg_data = session.read(_CLASSIC_ADR[slot])
+            if reg_data is None: # return what has been read so far
+                if slot == 0:
+                    return None
+                break
+            end = reg_data.find(b'\0')
+            if end >= 0: # Null found.  Job complete.
+                text.extend(reg_data[:end])
+                break
+            text.extend(reg_data)
+    return ''.join(chr(x) for x in text)
 
 # Reads text from the tag.
 def readText(self, timeout=0):
-    text = ''
-    read_tag_id_result = self.readTagID()
-    start = now()
-    while read_tag_id_result['success'] is False:
-        read_tag_id_result = self.readTagID()
-        if timeout > 0 and now() - start > timeout: break # trigger a timeout
-    if read_tag_id_result['type'] == 'ntag':
-        text = self._readTextFromNtag()
-    if read_tag_id_result['type'] == 'classic':
-        text = self._readTextFromClassic()
-    return text
+    def read(tag):
+        if tag['type'] == 'ntag':
+            return self._readTextFromNtag()
+        return self._readTextFromClassic()
+    text = self._withTag(read, timeout)
+    return '' if text is None else text
+
+# ----------------------------- NDEF --------------------------------------------------
+
+# Size of the NTAG data area from its capability container [bytes]
+def _ntagDataSize(cc):
+    if cc[0] == _NTAG_CC_MAGIC:
+        return cc[2] * 8
+    return (_NTAG_PAGE_ADR_MAX - _NTAG_PAGE_ADR_MIN + 1) * _NTAG_NO_BYTES_PER_PAGE
+
+# Read the NDEF message from NTAG. Returns a list of records ([] if the tag holds no message), or None if the tag did not answer
+def _readNdefFromNtag(self):
+    from PiicoDev_NDEF import findTLV, decodeMessage
+    head = self._readNtagPages(_NTAG_PAGE_CC, _NTAG_PAGE_CC + _NTAG_FAST_READ_MAX_PAGES - 1)
+    if head is None:
+        return None
+    data = head[_NTAG_NO_BYTES_PER_PAGE:]
+    found = findTLV(data)
+    if found is None:
+        return []
+    length = found[0] + found[1]
+    if length > _ntagDataSize(head):
+        print('Error reading NDEF message')
+        return []
+    if length > len(data): # the message continues past the first read
+        data = self._readNtagPages(_NTAG_PAGE_ADR_MIN, _NTAG_PAGE_ADR_MIN + (length - 1) // _NTAG_NO_BYTES_PER_PAGE, cached=True)
+        if data is None:
+            return None
+    try:
+        return decodeMessage(data[found[0]:length])
+    except ValueError:
+        print('Error reading NDEF message')
+        return []
+
+# Reads the NDEF message from the tag (NTAG only). Returns a list of PiicoDev_NDEF.Record, or None if no tag was read.
+# Waits for a tag when timeout is 0, otherwise for up to timeout seconds
+def readNDEF(self, timeout=0):
+    def read(tag):
+        if tag['type'] != 'ntag':
+            print('NDEF is only supported on NTAG')
+            return False
+        return self._readNdefFromNtag()
+    records = self._withTag(read, timeout)
+    return None if records is False else records
+
+# Writes an NDEF message to the tag (NTAG only). records is a list of PiicoDev_NDEF.Record or an encoded message.
+# Only pages that change are written
+def writeNDEF(self, records, timeout=None):
+    from PiicoDev_NDEF import encodeMessage, wrapTLV
+    if isinstance(records, (bytes, bytearray)):
+        image = wrapTLV(records)
+    else:
+        image = wrapTLV(encodeMessage(records))
+    end_page = _NTAG_PAGE_ADR_MIN + (len(image) - 1) // _NTAG_NO_BYTES_PER_PAGE
+    def write(tag):
+        if tag['type'] != 'ntag':
+            print('NDEF is only supported on NTAG')
+            return False
+        cc = self._readNtagPages(_NTAG_PAGE_CC, min(end_page, _NTAG_PAGE_CC + _NTAG_FAST_READ_MAX_PAGES - 1))
+        if cc is None:
+            return None
+        if len(image) > _ntagDataSize(cc):
+            raise ValueError('NDEF message is too long for this tag')
+        return True if self._writeNtagImage(_NTAG_PAGE_ADR_MIN, image, cached=True) else None # cc was read from the tag above
+    return self._withTag(write, timeout) is True
 
 # ----------------------------- Write Link --------------------------------------------
 
-# Writes a URI to the tag
-def writeURI(self, uri): # Currently only supported by NTAG213
-    is_ndef_message = chr(3)
-    ndef_length = chr(len(uri) + 5)
-    ndef_record_header = chr(209)
-    ndef_type_length = chr(1)
-    ndef_payload_length = chr(len(uri) + 1)
-    is_uri_record = chr(85)
-    record_type_indicator = chr(0)
-    tlv_terminator = chr(254)
-    ndef = is_ndef_message + ndef_length + ndef_record_header + ndef_type_length + ndef_payload_length + is_uri_record + record_type_indicator + uri + tlv_terminator
-    success = self.writeText(ndef, ignore_null=True)
-    return success
+# Writes a URI to the tag as an NDEF URI record
+def writeURI(self, uri): # Currently only supported by NTAG
+    from PiicoDev_NDEF import uriRecord
+    return self.writeNDEF([uriRecord(uri)])
@@ -0,0 +1,215 @@
+# Batch provisioning of tags with the Core Electronics PiicoDev RFID Module
+# Waits for each new tag, writes the next payload through the differential write path, verifies
+# it, and journals per-tag phase timings. Tags already in the journal are skipped, so a run that
+# is interrupted can be resumed by starting it again with the same payloads and journal.
+#
+# Example:
+#   rfid = PiicoDev_RFID()
+#   provisioner = PiicoDev_RFID_Provisioner(rfid, journal='tags.csv')
+#   provisioner.provision('Asset {}'.format(i) for i in range(1000))
+#
+# Payloads are text (str), a number (int, written to slot 35), a list of PiicoDev_NDEF records (NTAG only),
+# or a dict with one of 'text', 'number' (and optionally 'slot'), 'uri' or 'records'.
+
+from PiicoDev_Unified import *
+from PiicoDev_RFID_Expansion import TagTracker, _textImage, _NTAG_PAGE_ADR_MIN, _NTAG_PAGE_ADR_MAX, _NTAG_NO_BYTES_PER_PAGE, _CLASSIC_ADR, _CLASSIC_NO_BYTES_PER_REG
+import struct
+from time import time as now
+try:
+    import ujson as json
+except:
+    import json
+
+_PHASES = ('detect', 'auth', 'write', 'verify')
+_JOURNAL_FIELDS = ('index', 'uid', 'type', 'status', 'detect_ms', 'auth_ms', 'write_ms', 'verify_ms', 'total_ms', 'time')
+_TEXT_BYTES = (_NTAG_PAGE_ADR_MAX - _NTAG_PAGE_ADR_MIN + 1) * _NTAG_NO_BYTES_PER_PAGE
+
+# Where and what to write for a payload: (first NTAG page, Classic blocks or None if NTAG only, image)
+def _plan(payload):
+    if isinstance(payload, dict):
+        if 'text' in payload:
+            payload = payload['text']
+        elif 'number' in payload:
+            return _planNumber(payload['number'], payload.get('slot', 35))
+        elif 'uri' in payload:
+            from PiicoDev_NDEF import uriRecord
+            payload = [uriRecord(payload['uri'])]
+        elif 'records' in payload:
+            payload = payload['records']
+        else:
+            raise ValueError("payload needs one of 'text', 'number', 'uri' or 'records'")
+    if isinstance(payload, str):
+        image = _textImage(payload + '\0', _TEXT_BYTES, False)
+        return (_NTAG_PAGE_ADR_MIN, _CLASSIC_ADR[:(len(image) + _CLASSIC_NO_BYTES_PER_REG - 1) // _CLASSIC_NO_BYTES_PER_REG], image)
+    if isinstance(payload, int):
+        return _planNumber(payload, 35)
+    from PiicoDev_NDEF import encodeMessage, wrapTLV
+    return (_NTAG_PAGE_ADR_MIN, None, wrapTLV(encodeMessage(payload)))
+
+def _planNumber(number, slot):
+    assert slot >= 0 and slot < len(_CLASSIC_ADR), 'Slot must be between 0 and 35'
+    return (_NTAG_PAGE_ADR_MIN + slot, [_CLASSIC_ADR[slot]], struct.pack('<l', number))
+
+class PiicoDev_RFID_Provisioner(object):
+    def __init__(self, rfid, journal=None, holdoff_ms=300, retries=3):
+        self.rfid = rfid
+        self.journal = journal # path ending in .csv for CSV, otherwise JSON lines
+        self.retries = retries
+        self.tracker = TagTracker(rfid, holdoff_ms)
+        self.done = set() # UIDs (formatted) provisioned successfully
+        self.results = []
+        self._completed = 0 # payloads consumed, including those from an earlier run
+        self._started = None
+        self._journal_empty = True
+        if journal is not None:
+            self._loadJournal()
+
+    # Provision one tag for each payload (or count tags). Waits for each new tag to arrive, skipping tags already provisioned.
+    # Payloads written in an earlier run with the same journal are skipped. on_tag is called with each result. Returns stats()
+    def provision(self, payloads, count=None, on_tag=None):
+        payloads = iter(payloads)
+        try:
+            for _ in range(self._completed): # resume where the journal left off
+                next(payloads)
+        except StopIteration:
+            return self.stats()
+        provisioned = 0
+        for payload in payloads:
+            if count is not None and provisioned >= count:
+                break
+            result = None
+            while result is None or result['status'] != 'ok': # a failed tag is retried with the same payload
+                result = self.provisionTag(payload)
+                if on_tag is not None:
+                    on_tag(result)
+            provisioned += 1
+        return self.stats()
+
+    # Wait for a tag not yet provisioned, then write and verify payload. Returns the result recorded in the journal
+    def provisionTag(self, payload):
+        page, blocks, image = _plan(payload)
+        tag = self._waitForNewTag()
+        rfid = self.rfid
+        if self._started is None:
+            self._started = tag['arrived']
+        timings = {'detect':tag['detect_ms'], 'auth':0, 'write':0, 'verify':0}
+        if tag['type'] == 'ntag':
+            ok = self._provisionNtag(page, image, timings)
+        elif blocks is not None:
+            ok = self._provisionClassic(blocks, image, timings)
+        else:
+            print('NDEF is only supported on NTAG')
+            ok = False
+        if not ok:
+            rfid._forgetTag()
+        result = {'index':self._completed, 'uid':tag['id_formatted'], 'type':tag['type'], 'status':'ok' if ok else 'failed'}
+        for phase in _PHASES:
+            result[phase + '_ms'] = timings[phase]
+        result['total_ms'] = ticks_diff(ticks_ms(), tag['arrived'])
+        result['time'] = int(now())
+        if ok:
+            self.done.add(tag['id_formatted'])
+            self._completed += 1
+        self.results.append(result)
+        self._appendJournal(result)
+        return result
+
+    # Throughput and mean phase timings for tags provisioned in this run
+    def stats(self):
+        ok = [r for r in self.results if r['status'] == 'ok']
+        elapsed_ms = ticks_diff(ticks_ms(), self._started) if self._started is not None else 0
+        stats = {'provisioned':len(ok), 'failed':len(self.results) - len(ok), 'elapsed_s':elapsed_ms / 1000,
+                 'tags_per_minute':len(ok) * 60000 / elapsed_ms if elapsed_ms else 0.0}
+        for phase in _PHASES + ('total',):
+            stats[phase + '_ms'] = sum(r[phase + '_ms'] for r in ok) / len(ok) if ok else 0.0
+        return stats
+
+    # Polls until a tag that is not already done arrives. The UID is read once on arrival and the tag stays selected.
+    # Detection time covers the poll that saw the tag and the UID read
+    def _waitForNewTag(self):
+        while True:
+            arrived = ticks_ms()
+            if self.tracker.update() != TagTracker.ARRIVED or self.tracker.tag['id_formatted'] in self.done:
+                continue
+            tag = dict(self.tracker.tag)
+            tag['arrived'] = arrived
+            tag['detect_ms'] = ticks_diff(ticks_ms(), arrived)
+            return tag
+
+    def _provisionNtag(self, page, image, timings):
+        rfid = self.rfid
+        image = bytes(image) + bytes(-len(image) % _NTAG_NO_BYTES_PER_PAGE)
+        start = ticks_ms()
+        ok = rfid._writeNtagImage(page, image, retries=self.retries, verify=False)
+        timings['write'] = ticks_diff(ticks_ms(), start)
+        if not ok:
+            return False
+        start = ticks_ms()
+        ok = rfid.readPages(page, page + len(image) // _NTAG_NO_BYTES_PER_PAGE - 1) == image
+        timings['verify'] = ticks_diff(ticks_ms(), start)
+        return ok
+
+    def _provisionClassic(self, blocks, image, timings):
+        rfid = self.rfid
+        image = bytes(image) + bytes(len(blocks) * _CLASSIC_NO_BYTES_PER_REG - len(image))
+        start = ticks_ms()
+        session = rfid.classicSession()
+        ok = session is not None and session._authenticate(blocks[0])
+        timings['auth'] = ticks_diff(ticks_ms(), start)
+        if session is None:
+            return False
+        with session:
+            if not ok:
+                return False
+            start = ticks_ms()
+            ok = rfid._writeClassicImage(blocks, image, retries=self.retries, verify=False, session=session)
+            timings['write'] = ticks_diff(ticks_ms(), start)
+            if not ok:
+                return False
+            start = ticks_ms()
+            for i, block in enumerate(blocks):
+                if session.read(block) != image[i * _CLASSIC_NO_BYTES_PER_REG:(i + 1) * _CLASSIC_NO_BYTES_PER_REG]:
+                    ok = False
+                    break
+            timings['verify'] = ticks_diff(ticks_ms(), start)
+        return ok
+
+    def _csv(self):
+        return self.journal.lower().endswith('.csv')
+
+    # Recover the UIDs already provisioned and the number of payloads consumed
+    def _loadJournal(self):
+        try:
+            f = open(self.journal, 'r')
+        except OSError:
+            return
+        with f:
+            fields = None
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                self._journal_empty = False
+                if self._csv():
+                    if fields is None:
+                        fields = line.split(',')
+                        continue
+                    entry = dict(zip(fields, line.split(',')))
+                else:
+                    entry = json.loads(line)
+                if entry.get('status') == 'ok':
+                    self.done.add(entry['uid'])
+                    self._completed += 1
+
+    def _appendJournal(self, result):
+        if self.journal is None:
+            return
+        if self._csv():
+            line = ','.join(str(result[field]) for field in _JOURNAL_FIELDS)
+            if self._journal_empty:
+                line = ','.join(_JOURNAL_FIELDS) + '\n' + line
+        else:
+            line = json.dumps(result)
+        with open(self.journal, 'a') as f:
+            f.write(line + '\n')
+        self._journal_empty = False
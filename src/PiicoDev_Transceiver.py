@@ -38,6 +38,17 @@ _RFM69_REG_FRFMSB      = 0x07
 _RFM69_REG_FRFMID      = 0x08
 _RFM69_REG_FRFLSB      = 0x09
 
+_RFM69_FXOSC = 32000000 # Crystal oscillator frequency [Hz]
+_RFM69_FSTEP_SHIFT = 19  # Frequency synthesiser step is FXOSC / 2^19
+_RFM69_BANDS = ((290, 340), (424, 510), (862, 1020)) # Frequency ranges the RFM69 synthesiser covers [MHz]
+
+_SPEEDS = {1: 9600, 2: 115200, 3: 300000} # speed setting : bitrate [bps]
+
+_RFM69_FRAME_OVERHEAD = 11 # preamble (3), sync word (2), length, to, from and control bytes (4), CRC (2) [bytes]
+
+_RSSI_EWMA_WEIGHT = 0.125
+_RSSI_WINDOW = 32 # RSSI samples kept per peer for percentiles
+
 _MAXIMUM_PAYLOAD_LENGTH = 61 # The Low Power Labs Arduino library is limited to 65 bytes total payload including a 4 header bytes
 _MAXIMUM_I2C_SIZE = 32 #For ATmega328 based Arduinos, the I2C buffer is limited to 32 bytes
 
@@ -48,10 +59,88 @@ def truncate(n, decimals=0):
 def _set_bit(x, n):
     return x | (1 << n)
 
+def airtime_ms(length, bitrate):
+    """ Estimated time on air for a payload of length bytes at bitrate [bps]. Returns [ms] """
+    return (length + _RFM69_FRAME_OVERHEAD) * 8000 / bitrate
+
+def _percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+class _PeerStats(object):
+    """ Rolling link statistics for one transmitting radio """
+    def __init__(self, now):
+        self.packets = 0
+        self.bytes = 0
+        self.airtime_ms = 0.0
+        self.rssi = 0
+        self.rssi_ewma = None
+        self.rssi_window = []
+        self.first_ms = now
+        self.last_ms = None
+        self.interval_ms = None
+        self.jitter_ms = 0.0
+
+    def record(self, rssi, length, airtime, now):
+        self.packets += 1
+        self.bytes += length
+        self.airtime_ms += airtime
+        self.rssi = rssi
+        if self.rssi_ewma is None:
+            self.rssi_ewma = float(rssi)
+        else:
+            self.rssi_ewma += _RSSI_EWMA_WEIGHT * (rssi - self.rssi_ewma)
+        self.rssi_window.append(rssi)
+        if len(self.rssi_window) > _RSSI_WINDOW:
+            self.rssi_window.pop(0)
+        if self.last_ms is not None:
+            interval = ticks_diff(now, self.last_ms)
+            if self.interval_ms is not None: # RFC 3550 style inter-arrival jitter
+                self.jitter_ms += (abs(interval - self.interval_ms) - self.jitter_ms) / 16
+            self.interval_ms = interval
+        self.last_ms = now
+
+    def summary(self, now):
+        ordered = sorted(self.rssi_window)
+        span = ticks_diff(now, self.first_ms)
+        return {
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'airtime_ms': self.airtime_ms,
+            'rssi': self.rssi,
+            'rssi_ewma': self.rssi_ewma,
+            'rssi_min': ordered[0],
+            'rssi_p10': _percentile(ordered, 0.1),
+            'rssi_p50': _percentile(ordered, 0.5),
+            'rssi_p90': _percentile(ordered, 0.9),
+            'rssi_max': ordered[-1],
+            'packet_rate': self.packets * 1000 / span if span > 0 else 0.0,
+            'jitter_ms': self.jitter_ms,
+            'last_seen_ms': ticks_diff(now, self.last_ms),
+        }
+
+def rfm69_frequency_registers(frequency):
+    """ Returns the {register: value} FRF settings for a carrier frequency [MHz] """
+    for band in _RFM69_BANDS:
+        if band[0] <= frequency <= band[1]:
+            break
+    else:
+        raise ValueError('frequency {} MHz not supported'.format(frequency))
+    hz = int(frequency * 1000000 + 0.5)
+    frf = ((hz << _RFM69_FSTEP_SHIFT) + _RFM69_FXOSC // 2) // _RFM69_FXOSC
+    return {_RFM69_REG_FRFMSB: (frf >> 16) & 0xFF, _RFM69_REG_FRFMID: (frf >> 8) & 0xFF, _RFM69_REG_FRFLSB: frf & 0xFF}
+
+def rfm69_bitrate_registers(bitrate):
+    """ Returns the {register: value} bitrate divider settings for a bitrate [bps] """
+    bitrate = int(bitrate)
+    divider = (_RFM69_FXOSC + bitrate // 2) // bitrate if bitrate > 0 else 0
+    if not 32 <= divider <= 0xFFFF: # 1 Mbps is the fastest FSK rate
+        raise ValueError('bitrate {} bps not supported'.format(bitrate))
+    return {_RFM69_REG_BITRATEMSB: divider >> 8, _RFM69_REG_BITRATELSB: divider & 0xFF}
+
 class PiicoDev_Transceiver(object):
     def __init__(self, bus=None, freq=None, sda=None, scl=None, i2c_address=_BASE_ADDRESS, id=None, group=0, radio_address=0, speed=2, radio_frequency=922, tx_power=20, suppress_warnings=False, debug=False):
         try:
-            if compat_ind >= 1:
+            if compat_ind >= 2:
                 pass
             else:
                 print(compat_str)
@@ -72,6 +161,7 @@ class PiicoDev_Transceiver(object):
         if group > 255:
             group = 255
         self.debug=debug
+        self._rfm69_shadow = {} # last known value of each RFM69 register written through this driver
         if self.debug:
             print('start updating radio')
             sleep_ms(3000)
@@ -83,6 +173,7 @@ class PiicoDev_Transceiver(object):
             sleep_ms(10)
         self._write_int(_REG_RFM69_NETWORK_ID, group)
         self.rssi = 0
+        self.reset_stats()
         self.type = 0
         self.message = ''
         self.key = ''
@@ -90,6 +181,8 @@ class PiicoDev_Transceiver(object):
         self.received_bytes = b''
         self.source_radio_address = 0
         self.radio_frequency = radio_frequency
+        self._speed = 2 # module default, kept if speed is not valid
+        self._bitrate = _SPEEDS[2]
         self.speed = speed
         self.tx_power = tx_power
         try:
@@ -130,6 +223,9 @@ class PiicoDev_Transceiver(object):
             self._write(_REG_PAYLOAD, payload_list[i])
             sleep_ms(5) #was 12
         self._write_int(_REG_PAYLOAD_GO, 1)
+        self._tx_packets += 1
+        self._tx_bytes += len(payload)
+        self._tx_airtime_ms += airtime_ms(len(payload), self._bitrate)
         
     def _receive_payload(self):
         payload_length = 0
@@ -151,8 +247,47 @@ class PiicoDev_Transceiver(object):
                 unprocessed_payload_length -= _MAXIMUM_I2C_SIZE
                 sleep_ms(5)
             payload = payload[:payload_length]
+            if len(payload) >= 3:
+                self._record_rx(-payload[0], int.from_bytes(bytes(payload[1:3]), 'big'), payload_length - 3)
         return payload_length, payload
     
+    def _record_rx(self, rssi, source, length):
+        now = ticks_ms()
+        peer = self._peers.get(source)
+        if peer is None:
+            peer = _PeerStats(now)
+            self._peers[source] = peer
+        peer.record(rssi, length, airtime_ms(length, self._bitrate), now)
+
+    def reset_stats(self):
+        """ Clears all link statistics and restarts the accounting period """
+        self._peers = {}
+        self._stats_start = ticks_ms()
+        self._tx_packets = 0
+        self._tx_bytes = 0
+        self._tx_airtime_ms = 0.0
+
+    def stats(self, radio_address=None):
+        """ Link statistics. With a radio_address, returns that peer's RSSI (last, EWMA, percentiles), packet rate [packets/s],
+        inter-arrival jitter [ms] and airtime [ms], or None if it has not been heard. Otherwise returns totals for the
+        accounting period, including the fraction of time the channel was occupied by this radio and its peers """
+        now = ticks_ms()
+        if radio_address is not None:
+            peer = self._peers.get(radio_address)
+            return None if peer is None else peer.summary(now)
+        elapsed = ticks_diff(now, self._stats_start)
+        rx_airtime = sum(peer.airtime_ms for peer in self._peers.values())
+        return {
+            'elapsed_ms': elapsed,
+            'tx_packets': self._tx_packets,
+            'tx_bytes': self._tx_bytes,
+            'tx_airtime_ms': self._tx_airtime_ms,
+            'rx_packets': sum(peer.packets for peer in self._peers.values()),
+            'rx_airtime_ms': rx_airtime,
+            'channel_utilisation': (self._tx_airtime_ms + rx_airtime) / elapsed if elapsed > 0 else 0.0,
+            'peers': dict((address, self._peers[address].summary(now)) for address in self._peers),
+        }
+
     @property
     def _payload_new(self):
         """ Is set to 1 if a new payload has arrived """
@@ -170,15 +305,37 @@ class PiicoDev_Transceiver(object):
             return
         self._write_int(_REG_RFM69_TO_NODE_ID, value, 2)
 
-    def get_rfm69_register(self, register):
-        """ Gets a register on the RFM69 radio """
+    def get_rfm69_register(self, register, cached=False):
+        """ Gets a register on the RFM69 radio. cached=True returns the shadowed value without touching the bus if one is known """
+        if cached and register in self._rfm69_shadow:
+            return self._rfm69_shadow[register]
         self._write_int(_REG_RFM69_REG, register)
-        return self._read_int(_REG_RFM69_VALUE)
+        value = self._read_int(_REG_RFM69_VALUE)
+        if value is not None:
+            self._rfm69_shadow[register] = value
+        return value
         
     def set_rfm69_register(self, register, value):
         """ Sets a register on the RFM69 radio """
         self._write_int(_REG_RFM69_REG, register)
         self._write_int(_REG_RFM69_VALUE, value)
+        self._rfm69_shadow[register] = value
+
+    def apply_rfm69_registers(self, registers):
+        """ Writes a {register: value} dict to the RFM69, skipping registers the shadow says are already set. Returns the number of registers written """
+        changed = [(r, registers[r]) for r in sorted(registers) if self._rfm69_shadow.get(r) != registers[r] and r != _RFM69_REG_FRFLSB]
+        # The synthesiser only retunes when RegFrfLsb is written, so it goes last whenever any FRF byte changes, even if its own value is unchanged
+        if _RFM69_REG_FRFLSB in registers and (self._rfm69_shadow.get(_RFM69_REG_FRFLSB) != registers[_RFM69_REG_FRFLSB] or
+                                               any(r in (_RFM69_REG_FRFMSB, _RFM69_REG_FRFMID) for r, _ in changed)):
+            changed.append((_RFM69_REG_FRFLSB, registers[_RFM69_REG_FRFLSB]))
+        if len(changed) == 0:
+            return 0
+        while self.transceiver_ready == False:
+            sleep_ms(10)
+        for register, value in changed:
+            self.set_rfm69_register(register, value)
+            sleep_ms(5)
+        return len(changed)
 
     def on(self):
         """ Turns the RFM69 radio on """
@@ -191,6 +348,7 @@ class PiicoDev_Transceiver(object):
     def rfm69_reset(self):
         """ Resets the RFM69 radio """
         self._write_int(_REG_RFM69_RESET, 1)
+        self._rfm69_shadow = {} # the radio is back to its defaults
         sleep_ms(10)
     
     @property
@@ -201,29 +359,33 @@ class PiicoDev_Transceiver(object):
     @speed.setter
     def speed(self, speed):
         """ sets the over-the-air radio speed """
-        if speed == 1: # 9600
-            sleep_ms(10)
-            self.set_rfm69_register(_RFM69_REG_BITRATEMSB,0x0D)
-            sleep_ms(10)
-            self.set_rfm69_register(_RFM69_REG_BITRATELSB,0x05)
-            sleep_ms(10)
-            self._speed = 1
-        elif speed == 2: # 115200
-            sleep_ms(10)
-            self.set_rfm69_register(_RFM69_REG_BITRATEMSB,0x01)
-            sleep_ms(10)
-            self.set_rfm69_register(_RFM69_REG_BITRATELSB,0x16)
-            sleep_ms(10)
-            self._speed = 2
-        elif speed == 3: # 300000
-            sleep_ms(10)
-            self.set_rfm69_register(_RFM69_REG_BITRATEMSB,0x00)
-            sleep_ms(10)
-            self.set_rfm69_register(_RFM69_REG_BITRATELSB,0x6B)
-            sleep_ms(10)
-            self._speed = 3
-        else:
+        if speed not in _SPEEDS:
             print('* speed not valid')
+            return
+        self.bitrate = _SPEEDS[speed]
+    
+    @property
+    def bitrate(self):
+        """ gets the over-the-air bitrate [bps] """
+        return self._bitrate
+    
+    @bitrate.setter
+    def bitrate(self, bitrate):
+        """ sets the over-the-air bitrate [bps]. Any rate the RFM69 can divide down to is accepted """
+        try:
+            registers = rfm69_bitrate_registers(bitrate)
+        except ValueError:
+            print('* bitrate not valid')
+            return
+        self.apply_rfm69_registers(registers)
+        self._set_bitrate(bitrate)
+    
+    def _set_bitrate(self, bitrate):
+        self._bitrate = bitrate
+        self._speed = 0
+        for speed in _SPEEDS:
+            if _SPEEDS[speed] == bitrate:
+                self._speed = speed
     
     @property
     def radio_frequency(self):
@@ -232,56 +394,37 @@ class PiicoDev_Transceiver(object):
     
     @radio_frequency.setter
     def radio_frequency(self, frequency):
-        """ sets the radio transmitter frequency """
-        while self.transceiver_ready == False:
-            sleep_ms(10)
-        if frequency == 915:
-            sleep_ms(5)
-            self.set_rfm69_register(_RFM69_REG_FRFMSB,0xE4)
-            sleep_ms(5)
-            self.set_rfm69_register(_RFM69_REG_FRFMID,0xC0)
-            sleep_ms(5)
-            self.set_rfm69_register(_RFM69_REG_FRFLSB,0x00)
-            sleep_ms(5)
-            self._radio_frequency = 915
-        elif frequency == 918:
-            sleep_ms(5)
-            self.set_rfm69_register(_RFM69_REG_FRFMSB,0xE5)
-            sleep_ms(5)
-            self.set_rfm69_register(_RFM69_REG_FRFMID,0x80)
-            sleep_ms(5)
-            self.set_rfm69_register(_RFM69_REG_FRFLSB,0x00)
-            sleep_ms(5)
-            self._radio_frequency = 918
-        elif frequency == 922:
-            sleep_ms(5)
-            self.set_rfm69_register(_RFM69_REG_FRFMSB,0xE6)
-            sleep_ms(5)
-            self.set_rfm69_register(_RFM69_REG_FRFMID,0x80)
-            sleep_ms(5)
-            self.set_rfm69_register(_RFM69_REG_FRFLSB,0x00)
-            sleep_ms(5)
-            self._radio_frequency = 922
-        elif frequency == 925:
-            sleep_ms(5)
-            self.set_rfm69_register(_RFM69_REG_FRFMSB,0xE7)
-            sleep_ms(5)
-            self.set_rfm69_register(_RFM69_REG_FRFMID,0x40)
-            sleep_ms(5)
-            self.set_rfm69_register(_RFM69_REG_FRFLSB,0x00)
-            sleep_ms(5)
-            self._radio_frequency = 925
-        elif frequency == 928:
-            sleep_ms(5)
-            self.set_rfm69_register(_RFM69_REG_FRFMSB,0xE8)
-            sleep_ms(5)
-            self.set_rfm69_register(_RFM69_REG_FRFMID,0x00)
-            sleep_ms(5)
-            self.set_rfm69_register(_RFM69_REG_FRFLSB,0x00)
-            sleep_ms(5)
-            self._radio_frequency = 928
-        else:
+        """ sets the radio transmitter frequency [MHz] """
+        try:
+            registers = rfm69_frequency_registers(frequency)
+        except ValueError:
             print(' * frequency not supported')
+            return
+        self.apply_rfm69_registers(registers)
+        self._radio_frequency = frequency
+    
+    def configure(self, radio_frequency=None, speed=None, bitrate=None):
+        """ Retunes the radio in one batch, writing only the RFM69 registers that change. Returns the number of registers written """
+        if speed is not None:
+            if speed not in _SPEEDS:
+                print('* speed not valid')
+                return 0
+            bitrate = _SPEEDS[speed]
+        registers = {}
+        try:
+            if radio_frequency is not None:
+                registers.update(rfm69_frequency_registers(radio_frequency))
+            if bitrate is not None:
+                registers.update(rfm69_bitrate_registers(bitrate))
+        except ValueError as e:
+            print('* ' + str(e))
+            return 0
+        written = self.apply_rfm69_registers(registers)
+        if radio_frequency is not None:
+            self._radio_frequency = radio_frequency
+        if bitrate is not None:
+            self._set_bitrate(bitrate)
+        return written
     
     @property
     def tx_power(self):
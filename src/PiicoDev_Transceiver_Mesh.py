@@ -0,0 +1,162 @@
+# Multi-hop routing for the Core Electronics PiicoDev Transceiver
+# Nodes learn their neighbours from received packets, cache the best next hop
+# towards every origin they hear from, and flood (with duplicate suppression)
+# when no route is known. Every packet carries a TTL so floods die out.
+#
+# Works with PiicoDev_Transceiver or any radio exposing send_bytes(), receive_bytes(),
+# received_bytes, rssi, source_radio_address and radio_address (eg. PiicoDev_Transceiver_Sim).
+
+from PiicoDev_Unified import *
+try:
+    from ustruct import pack, unpack
+except:
+    from struct import pack, unpack
+
+_KIND_DATA  = 1
+_KIND_HELLO = 2
+
+_HEADER_FORMAT = '>BBBBBB' # kind, origin, destination, sequence, ttl, hops
+_HEADER_LENGTH = 6
+_MAXIMUM_PAYLOAD_LENGTH = 61
+MAXIMUM_DATA_LENGTH = _MAXIMUM_PAYLOAD_LENGTH - _HEADER_LENGTH
+
+BROADCAST = 0 # radio address 0 reaches every node in range
+
+class PiicoDev_Mesh(object):
+    def __init__(self, radio, ttl=4, hello_interval_ms=5000, neighbour_timeout_ms=15000, route_timeout_ms=30000, rssi_floor=-95, seen_size=64, rssi_weight=0.25, clock=ticks_ms):
+        self.radio = radio
+        self.address = radio.radio_address
+        self.ttl = ttl
+        self.hello_interval_ms = hello_interval_ms
+        self.neighbour_timeout_ms = neighbour_timeout_ms
+        self.route_timeout_ms = route_timeout_ms
+        self.rssi_floor = rssi_floor
+        self.rssi_weight = rssi_weight
+        self._clock = clock
+        self.neighbours = {} # address: [rssi EWMA, last heard (ms)]
+        self.routes = {}     # destination: [next hop, hops, last confirmed (ms)]
+        self._seen = set()   # (origin << 8) | sequence of recently handled packets
+        self._seen_order = []
+        self._seen_size = seen_size
+        self._sequence = 0
+        self._last_hello = None
+        self.stats = {'sent':0, 'delivered':0, 'forwarded':0, 'flooded':0, 'duplicates':0, 'expired':0}
+
+    # Sends data (bytes or str, up to MAXIMUM_DATA_LENGTH bytes) towards a radio address. BROADCAST reaches every node in the mesh.
+    def send(self, data, address=BROADCAST):
+        if isinstance(data, str):
+            data = bytes(data, 'utf8')
+        if len(data) > MAXIMUM_DATA_LENGTH:
+            raise ValueError('data must be at most {} bytes'.format(MAXIMUM_DATA_LENGTH))
+        self._sequence = (self._sequence + 1) & 0xFF
+        self._remember(self.address, self._sequence)
+        self.stats['sent'] += 1
+        self._transmit(_KIND_DATA, self.address, address, self._sequence, self.ttl, 0, data)
+        return self._sequence
+
+    # Announces this node to its neighbours
+    def hello(self):
+        self._last_hello = self._clock()
+        self._radio_send(pack(_HEADER_FORMAT, _KIND_HELLO, self.address, BROADCAST, 0, 1, 0), BROADCAST)
+
+    # Services the radio: handles at most one received packet and sends periodic hellos.
+    # Returns (origin, data) when a packet for this node arrives, otherwise None
+    def poll(self):
+        now = self._clock()
+        if self.hello_interval_ms and (self._last_hello is None or ticks_diff(now, self._last_hello) >= self.hello_interval_ms):
+            self.hello()
+        if not self.radio.receive_bytes():
+            return None
+        packet = bytes(self.radio.received_bytes)
+        if len(packet) < _HEADER_LENGTH:
+            return None
+        neighbour = self.radio.source_radio_address
+        self._heard(neighbour, self.radio.rssi, now)
+        kind, origin, destination, sequence, ttl, hops = unpack(_HEADER_FORMAT, packet[:_HEADER_LENGTH])
+        if kind != _KIND_DATA or origin == self.address:
+            return None
+        self._learn(origin, neighbour, hops + 1, now)
+        if self._remember(origin, sequence):
+            self.stats['duplicates'] += 1
+            return None
+        data = packet[_HEADER_LENGTH:]
+        if destination != self.address:
+            if ttl > 1:
+                self.stats['forwarded'] += 1
+                self._transmit(kind, origin, destination, sequence, ttl - 1, hops + 1, data)
+            else:
+                self.stats['expired'] += 1
+        if destination == self.address or destination == BROADCAST:
+            self.stats['delivered'] += 1
+            return (origin, data)
+        return None
+
+    # Returns the next hop towards a destination, or None if the packet must be flooded
+    def next_hop(self, destination, now=None):
+        if now is None:
+            now = self._clock()
+        route = self.routes.get(destination)
+        if route is None:
+            return None
+        if ticks_diff(now, route[2]) > self.route_timeout_ms or not self._usable(route[0], now):
+            del self.routes[destination]
+            return None
+        return route[0]
+
+    # Forgets neighbours and routes that have not been heard from recently
+    def expire(self):
+        now = self._clock()
+        for address in list(self.neighbours):
+            if ticks_diff(now, self.neighbours[address][1]) > self.neighbour_timeout_ms:
+                del self.neighbours[address]
+        for destination in list(self.routes):
+            self.next_hop(destination, now)
+
+    def _transmit(self, kind, origin, destination, sequence, ttl, hops, data):
+        header = pack(_HEADER_FORMAT, kind, origin, destination, sequence, ttl, hops)
+        next_hop = None
+        if destination != BROADCAST:
+            if destination in self.neighbours and self._usable(destination, self._clock()):
+                next_hop = destination
+            else:
+                next_hop = self.next_hop(destination)
+        if next_hop is None:
+            self.stats['flooded'] += 1
+            next_hop = BROADCAST
+        self._radio_send(header + data, next_hop)
+
+    def _radio_send(self, payload, address):
+        self.radio.send_bytes(payload, address=address)
+
+    def _heard(self, neighbour, rssi, now):
+        entry = self.neighbours.get(neighbour)
+        if entry is None:
+            self.neighbours[neighbour] = [rssi, now]
+        else:
+            entry[0] += self.rssi_weight * (rssi - entry[0])
+            entry[1] = now
+        self._learn(neighbour, neighbour, 1, now)
+
+    def _usable(self, neighbour, now):
+        entry = self.neighbours.get(neighbour)
+        return entry is not None and entry[0] >= self.rssi_floor and ticks_diff(now, entry[1]) <= self.neighbour_timeout_ms
+
+    # Keeps the shortest route to a destination, preferring the stronger link between equal-length routes
+    def _learn(self, destination, neighbour, hops, now):
+        if destination == self.address or not self._usable(neighbour, now):
+            return
+        route = self.routes.get(destination)
+        if route is None or route[0] == neighbour or ticks_diff(now, route[2]) > self.route_timeout_ms or not self._usable(route[0], now) or hops < route[1] \
+                or (hops == route[1] and self.neighbours[neighbour][0] > self.neighbours[route[0]][0]):
+            self.routes[destination] = [neighbour, hops, now]
+
+    # Records a packet as handled. Returns True if it had already been seen
+    def _remember(self, origin, sequence):
+        key = (origin << 8) | sequence
+        if key in self._seen:
+            return True
+        self._seen.add(key)
+        self._seen_order.append(key)
+        if len(self._seen_order) > self._seen_size:
+            self._seen.discard(self._seen_order.pop(0))
+        return False
@@ -0,0 +1,204 @@
+# Simulated PiicoDev Transceivers sharing a virtual radio channel
+# Lets PiicoDev_Transceiver_Mesh run with tens of nodes in one process, and
+# benchmarks delivery, latency and throughput without any hardware.
+#
+# Run directly for a quick benchmark:  python3 PiicoDev_Transceiver_Sim.py
+
+import random
+from math import log10, sqrt
+from time import monotonic
+from PiicoDev_Transceiver_Mesh import PiicoDev_Mesh, BROADCAST
+try:
+    from ustruct import pack, unpack
+except:
+    from struct import pack, unpack
+
+_FRAME_OVERHEAD = 11 # preamble (3), sync word (2), length, to, from and control bytes (4), CRC (2) [bytes]
+
+# A shared channel. Radios within range of each other hear every transmission
+# after its airtime has elapsed. Time is virtual and only moves with advance().
+# Radios are half-duplex and there is no capture effect: a packet is lost at a
+# receiver when its airtime overlaps another transmission heard there, or when
+# the receiver is transmitting itself. There is no carrier sense, and a radio
+# asked to send while still transmitting sends when its current packet ends
+class SimulatedAir(object):
+    def __init__(self, range_m=100, bitrate=115200, loss=0.0, rssi_1m=-40, path_loss_exponent=2.7, rssi_noise=2.0, seed=None):
+        self.range_m = range_m
+        self.bitrate = bitrate
+        self.loss = loss
+        self.rssi_1m = rssi_1m
+        self.path_loss_exponent = path_loss_exponent
+        self.rssi_noise = rssi_noise
+        self.random = random.Random(seed)
+        self.radios = {}
+        self.now_ms = 0.0
+        self.transmissions = 0
+        self.airtime_ms = 0.0
+        self.collisions = 0 # packets for a receiver lost to overlapping transmissions there
+        self.half_duplex_losses = 0 # packets for a receiver lost because it was transmitting
+        self._in_flight = [] # [start, end, receiving radio, payload, source address, rssi, addressed to the receiver, lost]
+
+    def ticks_ms(self):
+        return int(self.now_ms)
+
+    def airtime(self, length):
+        """ Time on air for a payload of length bytes [ms] """
+        return (length + _FRAME_OVERHEAD) * 8000 / self.bitrate
+
+    def advance(self, ms):
+        """ Moves virtual time forward, delivering every packet that has finished arriving intact """
+        self.now_ms += ms
+        arrived = [p for p in self._in_flight if p[1] <= self.now_ms]
+        if arrived:
+            self._in_flight = [p for p in self._in_flight if p[1] > self.now_ms]
+            for _, _, radio, payload, source, rssi, addressed, lost in arrived:
+                if not addressed:
+                    continue
+                if lost is None:
+                    radio._inbox.append((payload, source, rssi))
+                elif lost == 'collision':
+                    self.collisions += 1
+                else:
+                    self.half_duplex_losses += 1
+        for radio in self.radios.values():
+            if radio._tx_end <= self.now_ms:
+                radio._tx_start = radio._tx_end = 0.0
+
+    def _transmit(self, sender, payload, address):
+        airtime = self.airtime(len(payload))
+        start = max(self.now_ms, sender._tx_end)
+        end = start + airtime
+        if sender._tx_end <= self.now_ms:
+            sender._tx_start = start
+        sender._tx_end = end
+        self.transmissions += 1
+        self.airtime_ms += airtime
+        for reception in self._in_flight: # the sender can't hear while it transmits
+            if reception[2] is sender and reception[0] < end and start < reception[1] and reception[7] is None:
+                reception[7] = 'half_duplex'
+        for radio in self.radios.values():
+            if radio is sender:
+                continue
+            distance = sqrt((radio.x - sender.x) ** 2 + (radio.y - sender.y) ** 2)
+            if distance > self.range_m:
+                continue
+            # Every radio in range hears the transmission, and it interferes there whoever it is addressed to
+            lost = None
+            if radio._tx_start < end and start < radio._tx_end:
+                lost = 'half_duplex'
+            for reception in self._in_flight:
+                if reception[2] is radio and reception[0] < end and start < reception[1]:
+                    lost = lost or 'collision'
+                    if reception[7] is None:
+                        reception[7] = 'collision'
+            addressed = (address == BROADCAST or address == radio.radio_address) and self.random.random() >= self.loss
+            rssi = self.rssi_1m - 10 * self.path_loss_exponent * log10(max(distance, 1)) + self.random.gauss(0, self.rssi_noise)
+            self._in_flight.append([start, end, radio, payload, sender.radio_address, int(rssi), addressed, lost])
+
+# Stands in for PiicoDev_Transceiver's byte interface
+class SimulatedRadio(object):
+    def __init__(self, air, radio_address, x=0, y=0):
+        self.air = air
+        self.radio_address = radio_address
+        self.x = x
+        self.y = y
+        self.rssi = 0
+        self.source_radio_address = 0
+        self.received_bytes = b''
+        self._inbox = []
+        self._tx_start = 0.0 # the transmissions queued on this radio, back to back [ms]
+        self._tx_end = 0.0
+        air.radios[radio_address] = self
+
+    def send_bytes(self, data, address=0):
+        self.air._transmit(self, bytes(data), address)
+
+    def receive_bytes(self):
+        if not self._inbox:
+            return False
+        self.received_bytes, self.source_radio_address, self.rssi = self._inbox.pop(0)
+        return True
+
+# Places nodes on a line, a square grid or at random, spaced so each node reaches its immediate neighbours
+def _layout(count, layout, spacing, rng):
+    if layout == 'line':
+        return [(i * spacing, 0) for i in range(count)]
+    if layout == 'grid':
+        side = int(sqrt(count - 1)) + 1
+        return [((i % side) * spacing, (i // side) * spacing) for i in range(count)]
+    if layout == 'random':
+        side = spacing * sqrt(count)
+        return [(rng.random() * side, rng.random() * side) for i in range(count)]
+    raise ValueError("layout must be 'line', 'grid' or 'random'")
+
+def benchmark(nodes=20, messages=200, layout='grid', spacing=80, range_m=100, bitrate=115200, loss=0.0, interval_ms=50, ttl=16, tick_ms=1, seed=1):
+    """ Sends messages between random pairs of simulated nodes and reports delivery, latency and throughput.
+    Packets that overlap at a receiver, or reach a node while it is transmitting, are lost (see SimulatedAir) """
+    assert 2 <= nodes <= 127, 'nodes must be between 2 and 127'
+    rng = random.Random(seed)
+    air = SimulatedAir(range_m=range_m, bitrate=bitrate, loss=loss, seed=seed)
+    meshes = []
+    for i, (x, y) in enumerate(_layout(nodes, layout, spacing, rng)):
+        radio = SimulatedRadio(air, i + 1, x, y)
+        meshes.append(PiicoDev_Mesh(radio, ttl=ttl, hello_interval_ms=0, clock=air.ticks_ms))
+    for mesh in meshes: # one round of hellos, one at a time, so everyone knows their neighbours
+        mesh.hello()
+        air.advance(air.airtime(6) + 1)
+    for mesh in meshes:
+        while mesh.poll() is not None or mesh.radio._inbox:
+            pass
+    air.collisions = air.half_duplex_losses = 0
+
+    sent = {}     # message number: (destination, time sent [ms])
+    latency = []
+    next_send = air.now_ms
+    message = 0
+    processed = 0
+    started = monotonic()
+    deadline = interval_ms * messages + 10000
+    while air.now_ms < deadline and (message < messages or len(latency) < len(sent)):
+        if message < messages and air.now_ms >= next_send:
+            source, destination = rng.sample(meshes, 2)
+            source.send(pack('>H', message), address=destination.address)
+            sent[message] = (destination.address, air.now_ms)
+            message += 1
+            next_send += interval_ms
+        for mesh in meshes:
+            while mesh.radio._inbox:
+                processed += 1
+                received = mesh.poll()
+                if received is None or len(received[1]) != 2:
+                    continue
+                number = unpack('>H', received[1])[0]
+                if number in sent and sent[number][0] == mesh.address and sent[number][1] is not None:
+                    latency.append(air.now_ms - sent[number][1])
+                    sent[number] = (mesh.address, None) # count each message once
+        air.advance(tick_ms)
+        if message >= messages and not air._in_flight and not any(mesh.radio._inbox for mesh in meshes):
+            break
+    elapsed = monotonic() - started
+    latency.sort()
+    delivered = len(latency)
+    return {
+        'nodes': nodes,
+        'messages': messages,
+        'delivered': delivered,
+        'delivery_ratio': delivered / messages,
+        'latency_mean_ms': sum(latency) / delivered if delivered else float('NaN'),
+        'latency_p50_ms': latency[delivered // 2] if delivered else float('NaN'),
+        'latency_max_ms': latency[-1] if delivered else float('NaN'),
+        'transmissions': air.transmissions,
+        'transmissions_per_message': air.transmissions / messages,
+        'collisions': air.collisions,
+        'half_duplex_losses': air.half_duplex_losses,
+        'channel_utilisation': air.airtime_ms / air.now_ms if air.now_ms else 0.0,
+        'throughput_msg_per_s': delivered / (air.now_ms / 1000) if air.now_ms else 0.0,
+        'packets_processed_per_s': processed / elapsed if elapsed else float('NaN'),
+        'wall_time_s': elapsed,
+    }
+
+if __name__ == '__main__':
+    for count in (10, 20, 50):
+        result = benchmark(nodes=count)
+        print('{nodes:3d} nodes: delivered {delivered}/{messages}, latency mean {latency_mean_ms:.1f} ms p50 {latency_p50_ms:.1f} ms max {latency_max_ms:.1f} ms, '
+              '{transmissions_per_message:.1f} tx/msg, {collisions} collisions, {throughput_msg_per_s:.1f} msg/s (simulated), {packets_processed_per_s:.0f} pkt/s processed'.format(**result))
@@ -7,28 +7,40 @@ Changelog:
     - 2023-01-31 L.Howell - Add minimal support for ESP32
     - 2023-05-17 M.Ruppe - Make I2CUnifiedMachine() more flexible on initialisation. Frequency is optional.
     - 2023-12-20 M.Taylor - added scan() function for quick userland test of connected i2c modules
+    - 2026-10-19 agent - Provide ticks_ms(), ticks_add() and ticks_diff() on every platform
+    - 2026-10-19 agent - Add readfrom_mem_into() to every I2C class
+    - 2026-10-19 agent - Bump compat_ind to 2 for drivers that need ticks_ms() or readfrom_mem_into()
 '''
 import os
 _SYSNAME = os.uname().sysname
-compat_ind = 1
+compat_ind = 2
 i2c_err_str = 'PiicoDev could not communicate with module at address 0x{:02X}, check wiring'
 setupi2c_str = ', run "sudo curl -L https://piico.dev/i2csetup | bash". Suppress this warning by setting suppress_warnings=True'
 
 if _SYSNAME == 'microbit':
     from microbit import i2c
-    from utime import sleep_ms
+    from utime import sleep_ms, ticks_ms, ticks_add, ticks_diff
     
 elif _SYSNAME == 'Linux':
     from smbus2 import SMBus, i2c_msg
-    from time import sleep
+    from time import sleep, monotonic
     from math import ceil
     
     def sleep_ms(t):
         sleep(t/1000)
 
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_add(t, delta):
+        return t + delta
+
+    def ticks_diff(t1, t0):
+        return t1 - t0
+
 else:
     from machine import I2C, Pin
-    from utime import sleep_ms
+    from utime import sleep_ms, ticks_ms, ticks_add, ticks_diff
 
 class I2CBase:
     def writeto_mem(self, addr, memaddr, buf, *, addrsize=8):
@@ -37,6 +49,9 @@ class I2CBase:
     def readfrom_mem(self, addr, memaddr, nbytes, *, addrsize=8):
         raise NotImplementedError('readfrom_mem')
 
+    def readfrom_mem_into(self, addr, memaddr, buf, *, addrsize=8):
+        raise NotImplementedError('readfrom_mem_into')
+
     def write8(self, addr, buf, stop=True):
         raise NotImplementedError('write')
 
@@ -65,6 +80,7 @@ class I2CUnifiedMachine(I2CBase):
 
         self.writeto_mem = self.i2c.writeto_mem
         self.readfrom_mem = self.i2c.readfrom_mem
+        self.readfrom_mem_into = self.i2c.readfrom_mem_into
 
     def write8(self, addr, reg, data):
         if reg is None:
@@ -93,6 +109,9 @@ class I2CUnifiedMicroBit(I2CBase):
         ad = memaddr.to_bytes(addrsize // 8, 'big')  # pad address for eg. 16 bit
         i2c.write(addr, ad, repeat=True)
         return i2c.read(addr, nbytes)    
+
+    def readfrom_mem_into(self, addr, memaddr, buf, *, addrsize=8):
+        buf[:] = self.readfrom_mem(addr, memaddr, len(buf), addrsize=addrsize)
     
     def write8(self, addr, reg, data):
         if reg is None:
@@ -130,6 +149,10 @@ class I2CUnifiedLinux(I2CBase):
         data = [None] * nbytes # initialise empty list
         self.smbus_i2c_read(addr, memaddr, data, nbytes, addrsize=addrsize)
         return data
+
+    def readfrom_mem_into(self, addr, memaddr, buf, *, addrsize=8):
+        buf = memoryview(buf).cast('B') # fill arrays of any type byte by byte, as machine.I2C does
+        self.smbus_i2c_read(addr, memaddr, buf, len(buf), addrsize=addrsize)
     
     def writeto_mem(self, addr, memaddr, buf, *, addrsize=8):
         self.smbus_i2c_write(addr, memaddr, buf, len(buf), addrsize=addrsize)